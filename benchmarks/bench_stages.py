@@ -0,0 +1,116 @@
+'''
+Time each stage of the univariable pipeline on synthetic data and report throughput and peak memory as JSON lines
+
+    python benchmarks/bench_stages.py --sizes 10 100 1000 10000 --npairs 1 10 100 --out bench_output.txt
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mr import uni, simulate
+from mr.data import AnalyticData
+from mr.models import med, steig, presso
+from mr.plot import render
+
+# Each stage is a (setup, run) pair: setup prepares fresh inputs outside the timed region (run_steiger and run_radial add columns in place through the run_analyses nodes)
+# Wall time is the median over repeats without tracing; peak memory comes from one further run under tracemalloc,
+# since tracing itself slows allocation-heavy code
+# Per-instrument stages report variants/s, batch stages report pairs/s
+
+def prepare(frame):
+    return AnalyticData.from_frame(frame)
+
+def run_all(frame):
+    # Evaluate every model, since run_analyses only fits models when they are first accessed
+    data, res = uni.run_analyses(frame, seed=1)
+    return data, dict(res)
+
+def prepare_panel(pair):
+    (dataxy, resxy), (datayx, resyx) = run_all(pair[0]), run_all(pair[1])
+    return dataxy, datayx, resxy, resyx
+
+def run_panel(args, outdir):
+    return render.render(*args, outdir=outdir, outname='bench')
+
+def get_stages(outdir: str) -> dict:
+    return {
+        'run_main': (lambda pair: prepare(pair[0]), lambda data: uni.run_main(data, seed=1)),
+        'med.run_wm': (lambda pair: prepare(pair[0]), lambda data: med.run_wm(data, seed=1)),
+        'run_steiger': (lambda pair: prepare(pair[0]), uni.run_steiger),
+        'run_radial': (lambda pair: prepare(pair[0]), uni.run_radial),
+        'presso.run_presso': (lambda pair: prepare(pair[0]), lambda data: presso.run_presso(data, seed=1)),
+        'panel.mr_panel': (prepare_panel, lambda args: run_panel(args, outdir))
+    }
+
+def get_batch_stages(nworkers: int) -> dict:
+    return {
+        'batch.run_analyses': lambda pairs: [run_all(frame) for pair in pairs for frame in pair],
+        'batch.run_analyses_pool': lambda pairs: run_pool(pairs, nworkers),
+        'batch.steiger_stacked': lambda pairs: steig.flag_failures_stacked([frame for pair in pairs for frame in pair])
+    }
+
+def run_pool(pairs, nworkers):
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        return list(executor.map(run_all, [frame for pair in pairs for frame in pair]))
+
+def measure(setup, run, source, repeats: int) -> dict:
+    times = []
+    for _ in range(repeats):
+        args = setup(source)
+        start = time.perf_counter()
+        run(args)
+        times.append(time.perf_counter() - start)
+    args = setup(source)
+    tracemalloc.start()
+    run(args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+    return {'seconds': times[len(times)//2], 'min_seconds': times[0], 'peak_bytes': peak}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000], help='Instrument counts per pair')
+    parser.add_argument('--npairs', type=int, nargs='+', default=[1, 10, 100], help='Pair counts for batch stages')
+    parser.add_argument('--batch-size', type=int, default=100, help='Instruments per pair in batch stages')
+    parser.add_argument('--stages', nargs='+', default=None, help='Subset of stage names to run')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--outlier-rate', type=float, default=0.05)
+    parser.add_argument('--pleiotropy-sd', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default=None, help='Write JSON lines here instead of stdout')
+    args = parser.parse_args(argv)
+
+    render.use_headless()
+    simkwargs = {'outlier_rate': args.outlier_rate, 'pleiotropy_sd': args.pleiotropy_sd}
+    out = open(args.out, 'w') if args.out else sys.stdout
+    wanted = (lambda stage: args.stages is None or stage in args.stages)
+    with tempfile.TemporaryDirectory() as outdir:
+        for nvar in args.sizes:
+            pair = simulate.simulate_pairs(1, nvar, seed=args.seed, **simkwargs)[0]
+            for stage, (setup, run) in get_stages(outdir).items():
+                if wanted(stage):
+                    record = {'stage': stage, 'nvar': nvar, 'npairs': 1, 'repeats': args.repeats, **measure(setup, run, pair, args.repeats)}
+                    record['variants_per_second'] = nvar/record['seconds']
+                    print(json.dumps(record), file=out, flush=True)
+        for npairs in args.npairs:
+            pairs = simulate.simulate_pairs(npairs, args.batch_size, seed=args.seed, **simkwargs)
+            for stage, run in get_batch_stages(args.nworkers).items():
+                if wanted(stage):
+                    record = {'stage': stage, 'nvar': args.batch_size, 'npairs': npairs, 'repeats': args.repeats,
+                              **measure(lambda source: source, run, pairs, args.repeats)}
+                    record['pairs_per_second'] = npairs/record['seconds']
+                    print(json.dumps(record), file=out, flush=True)
+    if args.out:
+        out.close()
+
+if __name__ == '__main__':
+    main()
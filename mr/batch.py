@@ -0,0 +1,225 @@
+'''
+Run univariable MR systematically across many exposure/outcome pairs, using a process pool or a pipeline of extraction threads
+'''
+import os
+import heapq
+import itertools
+import traceback
+import contextlib
+import contextvars
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import uni, timing, store as results_store
+
+# Each direction of each pair is submitted as its own task, so xy and yx for the same pair can run on separate cores
+# Results are yielded per pair as soon as both of its directions have finished, in completion order rather than input order
+# Failures are caught inside the worker and returned as a traceback string, so one bad pair never aborts the batch
+# Timing sinks live in the calling process, so when any are registered workers collect their records and return them for re-emitting
+
+def get_pairs(xpaths: list, ypaths: list) -> list:
+    '''
+    Return all (exposure, outcome) path pairs from the product of the two lists, dropping self-pairs
+    '''
+    return [(xpath, ypath) for xpath, ypath in itertools.product(xpaths, ypaths) if xpath != ypath]
+
+def assign_shards(pairs: list, weights: list = None, nshards=1) -> list:
+    '''
+    Assign each pair to one of nshards shards, balancing the total weight (e.g. expected instrument count) per shard
+    Return the shard index (0 to nshards-1) of each pair, in input order
+    '''
+    # Greedy longest-processing-time: heaviest pairs first, each to the currently lightest shard
+    # Ties are broken by the pair paths and the shard index, so every array task computes the same assignment from the same manifest
+    weights = [1]*len(pairs) if weights is None else list(weights)
+    loads = [(0, shard) for shard in range(nshards)]
+    shards = [None]*len(pairs)
+    for i in sorted(range(len(pairs)), key=lambda i: (-weights[i], pairs[i])):
+        load, shard = heapq.heappop(loads)
+        shards[i] = shard
+        heapq.heappush(loads, (load + weights[i], shard))
+    return shards
+
+def run_direction_safe(xpath: str, ypath: str, collect_timing=False, **kwargs) -> dict:
+    '''
+    Wrapper around uni.run_direction for use in worker processes
+    Return a dict holding either the (data, results) tuple or the formatted traceback of the failure, plus any timing records
+    '''
+    with (timing.collect(exclusive=True) if collect_timing else contextlib.nullcontext([])) as records:
+        try:
+            # Evaluate every model here, inside the timing scope and the error handling, rather than when pickling the result
+            data, res = uni.run_direction(xpath, ypath, **kwargs)
+            return {'output': (data, dict(res)), 'error': None, 'timing': records}
+        except Exception:
+            return {'output': None, 'error': traceback.format_exc(), 'timing': records}
+
+def get_direction_kwargs(path: str, signalkey: str, get_proxies: bool, omit: dict, rsids: dict) -> dict:
+    '''
+    Omit and rsid filters are passed as dicts keyed by HDF path, since each path can be the x of one direction and the y of another
+    '''
+    return {
+        'signalkey': signalkey,
+        'get_proxies': get_proxies,
+        'omit': (omit or {}).get(path),
+        'rsids': (rsids or {}).get(path)
+    }
+
+def run_batch(xpaths: list = None,
+              ypaths: list = None,
+              pairs: list = None,
+              nworkers: int = None,
+              xsignalkey = 'main',
+              ysignalkey = 'main',
+              get_proxies=True,
+              omit: dict = None,
+              rsids: dict = None,
+              renderer = None,
+              store: str = None,
+              profile: dict = None,
+              window: int = None,
+              **kwargs):
+    '''
+    Run both directions of MR for every pair, either from the product of xpaths and ypaths or an explicit list of (xpath, ypath) pairs
+    Remaining kwargs (e.g. nboot, seed) are passed through to run_analyses
+    Generator yielding one dict per pair as it finishes, with keys xpath, ypath, xy, yx and error
+    xy and yx hold the (data, results) tuples from run_analyses, or None if that direction failed
+    If a plot.render.Renderer is given, each successful pair is passed to it as it finishes
+    If a store path is given, pairs already completed there are skipped and each successful pair is appended to it
+    profile maps selected (xpath, ypath) pairs to a path prefix for cProfile/tracemalloc output (suffixed .xy and .yx)
+    window is the number of directions submitted to the pool at once (by default twice the number of workers)
+    '''
+    pairs = get_pairs(xpaths, ypaths) if pairs is None else list(pairs)
+    if store is not None:
+        done = results_store.completed_pairs(store)
+        pairs = [pair for pair in pairs if pair not in done]
+    profile = {} if profile is None else profile
+    kwargs['collect_timing'] = bool(timing.SINKS)
+    # Tasks are submitted in pair order through a bounded window, and each future is dropped once read,
+    # so memory holds at most window directions' results however many pairs there are
+    window = 2*(nworkers or os.cpu_count() or 1) if window is None else window
+    tasks = ((pair, direction) for pair in pairs for direction in ['xy', 'yx'])
+    pending, futures = {}, {}
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        def submit(pair, direction):
+            xpath, ypath = pair if direction == 'xy' else pair[::-1]
+            prefix = profile.get(pair)
+            if direction == 'xy':
+                pending[pair] = {'xpath': pair[0], 'ypath': pair[1], 'xy': None, 'yx': None, 'error': None, 'ndone': 0}
+            futures[executor.submit(run_direction_safe, xpath, ypath,
+                                    **get_direction_kwargs(xpath, xsignalkey if direction == 'xy' else ysignalkey, get_proxies, omit, rsids),
+                                    profile=(f'{prefix}.{direction}' if prefix is not None else None), **kwargs)] = (pair, direction)
+        for task in itertools.islice(tasks, window):
+            submit(*task)
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pair, direction = futures.pop(future)
+                for task in itertools.islice(tasks, 1):
+                    submit(*task)
+                # A crashed worker or an unpicklable result surfaces here rather than inside run_direction_safe
+                try:
+                    out = future.result()
+                except Exception:
+                    out = {'output': None, 'error': traceback.format_exc(), 'timing': []}
+                for record in out['timing']:
+                    timing.emit(record)
+                result = pending[pair]
+                result[direction] = out['output']
+                if out['error'] is not None:
+                    add_error(result, direction, out['error'])
+                result['ndone'] += 1
+                if result['ndone'] == 2:
+                    del result['ndone']
+                    finish_pair(result, renderer, store)
+                    yield pending.pop(pair)
+
+def add_error(result: dict, step: str, error: str):
+    result['error'] = '\n'.join(filter(None, [result['error'], f"[{step}] {error}"]))
+
+def finish_pair(result: dict, renderer=None, store: str = None):
+    '''
+    Append a successful pair to the store and pass it to the renderer
+    Failures are recorded in the pair's error, as for failures in the models, rather than ending the batch
+    '''
+    if result['error'] is not None:
+        return
+    with timing.labels(xpath=result['xpath'], ypath=result['ypath']):
+        if store is not None:
+            try:
+                results_store.append_pair(store, result['xpath'], result['ypath'], result['xy'], result['yx'])
+            except Exception:
+                add_error(result, 'store', traceback.format_exc())
+        if renderer is not None:
+            try:
+                renderer.submit(result['xy'][0], result['yx'][0], result['xy'][1], result['yx'][1])
+            except Exception:
+                add_error(result, 'render', traceback.format_exc())
+
+# ----->>>>> Pipelined extraction in one process
+
+# run_pipelined analyses pairs in input order in the calling process, while a pool of I/O threads extracts the analytic data
+# for the directions that come next (HDF reads and proxy lookups spend most of their time outside the GIL)
+# Backpressure: a new extraction is only started when the consumer takes one, so at most depth extracted dataframes
+# (plus the one being analysed) are held at once, however many outcomes there are
+# Timing records from extraction threads keep the labels of their direction, since each task runs in a copy of the context
+
+def prefetch(func, tasks, nthreads=2, depth=4):
+    '''
+    Yield (task, future) for each task tuple in order, with func(*task) running in nthreads threads up to depth tasks ahead
+    '''
+    tasks = iter(tasks)
+    queue = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=nthreads)
+    submit = (lambda task: queue.append((task, executor.submit(contextvars.copy_context().run, func, *task))))
+    try:
+        for task in itertools.islice(tasks, depth):
+            submit(task)
+        while queue:
+            task, future = queue.popleft()
+            for task_next in itertools.islice(tasks, 1):
+                submit(task_next)
+            yield task, future
+    finally:
+        # If the consumer stops early, extractions not yet started are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def run_pipelined(xpaths: list = None,
+                  ypaths: list = None,
+                  pairs: list = None,
+                  xsignalkey = 'main',
+                  ysignalkey = 'main',
+                  get_proxies=True,
+                  omit: dict = None,
+                  rsids: dict = None,
+                  cachedir: str = None,
+                  renderer = None,
+                  store: str = None,
+                  nthreads=2,
+                  depth=4,
+                  **kwargs):
+    '''
+    Run both directions of MR for every pair in this process, prefetching the extraction of upcoming directions in threads
+    Arguments and yielded dicts are as for run_batch, but pairs are yielded in input order
+    nthreads is the number of extraction threads and depth the number of directions extracted ahead of the analysis
+    '''
+    pairs = get_pairs(xpaths, ypaths) if pairs is None else list(pairs)
+    if store is not None:
+        done = results_store.completed_pairs(store)
+        pairs = [pair for pair in pairs if pair not in done]
+    tasks = ((xpath, ypath, signalkey, get_proxies, (omit or {}).get(xpath), (rsids or {}).get(xpath), cachedir)
+             for pair in pairs
+             for (xpath, ypath), signalkey in [(pair, xsignalkey), (pair[::-1], ysignalkey)])
+    result = None
+    for task, future in prefetch(uni.extract_direction, tasks, nthreads, depth):
+        xpath, ypath = task[:2]
+        if result is None:
+            result, direction = {'xpath': xpath, 'ypath': ypath, 'xy': None, 'yx': None, 'error': None}, 'xy'
+        else:
+            direction = 'yx'
+        try:
+            with timing.labels(xpath=xpath, ypath=ypath):
+                result[direction] = uni.run_analyses(future.result(), **kwargs)
+        except Exception:
+            add_error(result, direction, traceback.format_exc())
+        if direction == 'yx':
+            finish_pair(result, renderer, store)
+            yield result
+            result = None
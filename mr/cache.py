@@ -0,0 +1,134 @@
+'''
+Persistent on-disk cache for analytic dataframes extracted from HDF inputs
+'''
+import os
+import json
+import logging
+import tempfile
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sumstats.extract import instrument
+
+# Extraction (including proxy lookup) is deterministic given its inputs, so results are cached as Parquet files named by a hash of:
+#   - both absolute HDF paths, with their mtimes and sizes so that a rewritten input invalidates its entries
+#   - the signal key, get_proxies and the omit/rsid filters
+# DataFrame.attrs (xname/yname) are held as JSON in the Parquet schema metadata, since not every pandas version round-trips them
+# Files are written to a unique temporary name then renamed, so concurrent batch workers or threads never read a partial entry
+# Eviction is least-recently-used by file mtime, which is refreshed on every hit, and runs after each write
+
+DEFAULT_CACHEDIR = os.environ.get('EPIDMR_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'epid-mr'))
+DEFAULT_MAXBYTES = 2 * 1024**3
+ATTRS_KEY = b'epidmr.attrs'
+
+def normalise_filter(value):
+    '''
+    Omit/rsid filters can be passed as any (possibly nested) iterable or mapping, so convert them into a canonical form
+    before hashing: mappings keep their keys and values, and other iterables become sorted lists
+    '''
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if hasattr(value, 'item') and getattr(value, 'ndim', None) == 0:
+        # numpy scalars
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): normalise_filter(item) for key, item in value.items()}
+    try:
+        items = [normalise_filter(item) for item in value]
+    except TypeError:
+        return str(value)
+    # Items can be of mixed types, so order them by their serialised form
+    return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+
+def describe_path(path: str) -> dict:
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+def get_key(xpath: str, ypath: str, signalkey: str, get_proxies: bool, omit, rsids) -> str:
+    '''
+    Hash everything that determines the extracted dataframe
+    '''
+    spec = {
+        'x': describe_path(xpath),
+        'y': describe_path(ypath),
+        'signalkey': signalkey,
+        'get_proxies': bool(get_proxies),
+        'omit': normalise_filter(omit),
+        'rsids': normalise_filter(rsids)
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+def read(path: str) -> pd.DataFrame:
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    data = table.to_pandas()
+    data.attrs = json.loads(metadata[ATTRS_KEY]) if ATTRS_KEY in metadata else {}
+    # Touch the entry so that it is treated as most recently used
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # Another process evicted it after it was read; the data read is still valid
+        pass
+    return data
+
+def write(data: pd.DataFrame, path: str):
+    table = pa.Table.from_pandas(data)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), ATTRS_KEY: json.dumps(data.attrs, default=str).encode()})
+    # A unique temporary file per call, since threads of one process (e.g. extraction prefetch) can write the same key at once
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        pq.write_table(table, tmppath)
+        os.replace(tmppath, path)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+def evict(cachedir: str, maxbytes: int):
+    '''
+    Remove least recently used entries until the cache is no larger than maxbytes
+    '''
+    entries = []
+    for entry in os.scandir(cachedir):
+        if entry.name.endswith('.parquet'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= maxbytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another process evicted it first
+            pass
+        total -= size
+
+def get_analytic_dataframe(xpath: str,
+                           ypath: str,
+                           signalkey='main',
+                           get_proxies=True,
+                           omit=None,
+                           rsids=None,
+                           cachedir: str = DEFAULT_CACHEDIR,
+                           maxbytes: int = DEFAULT_MAXBYTES) -> pd.DataFrame:
+    '''
+    Cached equivalent of sumstats.extract.instrument.get_analytic_dataframe with the same positional arguments
+    '''
+    os.makedirs(cachedir, exist_ok=True)
+    path = os.path.join(cachedir, f'{get_key(xpath, ypath, signalkey, get_proxies, omit, rsids)}.parquet')
+    try:
+        return read(path)
+    except (OSError, pa.ArrowInvalid):
+        # Missing or unreadable (e.g. truncated) entries are simply re-extracted and overwritten
+        pass
+    data = instrument.get_analytic_dataframe(xpath, ypath, signalkey, get_proxies, omit, rsids)
+    try:
+        write(data, path)
+        evict(cachedir, maxbytes)
+    except OSError:
+        # The extraction itself succeeded, so a cache that cannot be written (full disk, read-only directory) only costs a future miss
+        logging.getLogger('mr.cache').warning('Could not write cache entry %s', path, exc_info=True)
+    return data
@@ -0,0 +1,133 @@
+'''
+Command-line entry point (epid-mr) to run univariable MR for a manifest of pairs split into shards, e.g. as a cluster job array
+
+    epid-mr plan pairs.tsv --nshards 100
+    epid-mr run pairs.tsv --shard $((SLURM_ARRAY_TASK_ID-1)) --nshards 100 --outdir results
+    epid-mr merge results --out results/merged.h5 --manifest pairs.tsv
+'''
+import os
+import sys
+import glob
+import argparse
+import pandas as pd
+from . import batch, store
+
+# The manifest is a delimited text file with a header and columns exposure and outcome (HDF paths), plus an optional
+# weight column (e.g. the expected instrument count of the pair); pairs without a weight count as the mean weight
+# Every task reads the same manifest and computes the same assignment (batch.assign_shards), so shards need no coordination
+# Each shard writes its own append-only store, which already skips completed pairs on resume (store module),
+# so resubmitting a failed or killed task only runs the pairs it had not finished
+# Shards are numbered from 0; scheduler task ids starting at 1 need shifting
+
+def read_manifest(path: str) -> pd.DataFrame:
+    '''
+    Read the manifest, dropping repeated pairs and filling missing weights
+    '''
+    manifest = pd.read_csv(path, sep=None, engine='python', dtype={'exposure': str, 'outcome': str})
+    missing = {'exposure', 'outcome'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f'Manifest {path} is missing columns: {sorted(missing)}')
+    manifest = manifest.drop_duplicates(subset=['exposure', 'outcome']).reset_index(drop=True)
+    weight = manifest['weight'].astype(float) if 'weight' in manifest else pd.Series(1.0, index=manifest.index)
+    manifest['weight'] = weight.fillna(weight.mean() if weight.notna().any() else 1.0)
+    return manifest
+
+def get_shard_pairs(manifest: pd.DataFrame, shard: int, nshards: int) -> list:
+    pairs = list(zip(manifest['exposure'], manifest['outcome']))
+    shards = batch.assign_shards(pairs, manifest['weight'].tolist(), nshards)
+    return [pair for pair, assigned in zip(pairs, shards) if assigned == shard]
+
+def get_shard_path(outdir: str, shard: int, nshards: int) -> str:
+    return os.path.join(outdir, f'shard-{shard:05d}-of-{nshards:05d}.h5')
+
+def plan(args):
+    manifest = read_manifest(args.manifest)
+    manifest['shard'] = batch.assign_shards(list(zip(manifest['exposure'], manifest['outcome'])), manifest['weight'].tolist(), args.nshards)
+    summary = manifest.groupby('shard').agg(npairs=('weight', 'size'), weight=('weight', 'sum')).reindex(range(args.nshards), fill_value=0)
+    summary.to_csv(sys.stdout, sep='\t')
+
+def run(args):
+    if not 0 <= args.shard < args.nshards:
+        raise ValueError(f'--shard must be between 0 and {args.nshards-1}')
+    pairs = get_shard_pairs(read_manifest(args.manifest), args.shard, args.nshards)
+    os.makedirs(args.outdir, exist_ok=True)
+    storepath = get_shard_path(args.outdir, args.shard, args.nshards)
+    kwargs = {'nboot': args.nboot, 'seed': args.seed, 'iterative_radial': args.iterative_radial, 'steiger_fast': args.steiger_fast,
+              'steiger_source': args.steiger_source}
+    if args.presso_nsim is not None:
+        kwargs['presso'] = {'nsim': args.presso_nsim}
+    renderer = None
+    if args.plotdir is not None:
+        from .plot import render
+        os.makedirs(args.plotdir, exist_ok=True)
+        renderer = render.Renderer(outdir=args.plotdir, headless=True)
+    nfailed = 0
+    try:
+        for result in batch.run_batch(pairs=pairs, nworkers=args.nworkers, xsignalkey=args.xsignalkey, ysignalkey=args.ysignalkey,
+                                      get_proxies=not args.no_proxies, renderer=renderer, store=storepath, **kwargs):
+            if result['error'] is not None:
+                nfailed += 1
+                print(f"Failed: {result['xpath']} {result['ypath']}\n{result['error']}", file=sys.stderr)
+    finally:
+        if renderer is not None:
+            renderer.close()
+    print(f'Shard {args.shard} of {args.nshards}: {len(pairs)} pairs, {nfailed} failed, results in {storepath}', file=sys.stderr)
+    # A non-zero exit marks the task as failed so the scheduler (or user) resubmits it; completed pairs are then skipped
+    return 1 if nfailed else 0
+
+def merge(args):
+    paths = sorted(glob.glob(os.path.join(args.outdir, 'shard-*-of-*.h5')))
+    merged = store.merge_stores(paths, args.out)
+    print(f'Merged {len(merged)} pairs from {len(paths)} shard stores into {args.out}', file=sys.stderr)
+    if args.summary is not None and merged:
+        store.select_all(args.out, 'summary').to_csv(args.summary, sep='\t', index=False)
+    if args.manifest is not None:
+        manifest = read_manifest(args.manifest)
+        incomplete = [pair for pair in zip(manifest['exposure'], manifest['outcome']) if pair not in merged]
+        if incomplete:
+            print(f'{len(incomplete)} manifest pairs are not complete, e.g. {incomplete[0]}', file=sys.stderr)
+            return 1
+    return 0
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='epid-mr', description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    planparser = subparsers.add_parser('plan', help='Print the number of pairs and total weight assigned to each shard')
+    planparser.add_argument('manifest')
+    planparser.add_argument('--nshards', type=int, required=True)
+    planparser.set_defaults(func=plan)
+
+    runparser = subparsers.add_parser('run', help='Run both directions of MR for the pairs in one shard')
+    runparser.add_argument('manifest')
+    runparser.add_argument('--shard', type=int, required=True, help='Shard to run, from 0 to nshards-1')
+    runparser.add_argument('--nshards', type=int, required=True)
+    runparser.add_argument('--outdir', default='.', help='Directory for per-shard stores')
+    runparser.add_argument('--plotdir', default=None, help='Render a panel per pair into this directory')
+    runparser.add_argument('--nworkers', type=int, default=None)
+    runparser.add_argument('--xsignalkey', default='main')
+    runparser.add_argument('--ysignalkey', default='main')
+    runparser.add_argument('--no-proxies', action='store_true')
+    runparser.add_argument('--nboot', type=int, default=1000)
+    runparser.add_argument('--seed', type=int, default=None)
+    runparser.add_argument('--iterative-radial', action='store_true')
+    runparser.add_argument('--steiger-fast', action='store_true')
+    runparser.add_argument('--steiger-source', choices=['betase', 'pval'], default='betase',
+                           help='Inputs of the fast Steiger F (with --steiger-fast)')
+    runparser.add_argument('--presso-nsim', type=int, default=None, help='Also run MR-PRESSO with this many simulations')
+    runparser.set_defaults(func=run)
+
+    mergeparser = subparsers.add_parser('merge', help='Combine the per-shard stores into one store')
+    mergeparser.add_argument('outdir', help='Directory holding the per-shard stores')
+    mergeparser.add_argument('--out', required=True, help='Path of the merged store')
+    mergeparser.add_argument('--summary', default=None, help='Also write the merged summary table here as TSV')
+    mergeparser.add_argument('--manifest', default=None, help='Report (and exit non-zero for) manifest pairs missing from the merge')
+    mergeparser.set_defaults(func=merge)
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
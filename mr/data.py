@@ -0,0 +1,105 @@
+'''
+Compact array-backed container for analytic data, used in place of DataFrame copies throughout modelling and plotting
+'''
+import numpy as np
+import pandas as pd
+
+# An analytic dataframe is held as one contiguous float64 array per numeric column (beta/se/pval/n/ratio...),
+# object arrays for identifiers (rsid_x/rsid_y) and a separate set of named boolean masks (steiger_fail, radial_fail, proxy...)
+# Indexing with a boolean array returns a view: it shares the parent's column and mask dicts and holds only a selector,
+# so nothing is copied when the view is made and reading a column from it gathers just that column
+# Views see columns and masks added to the parent later, but cannot be written to themselves, so every per-variant
+# statistic is stored once at full length (NaN where it does not apply) on the parent
+# Column access mirrors DataFrame (data['beta_x'], len(data), data.attrs), so model, heterogeneity and plotting code can take either
+
+class AnalyticData:
+    '''
+    Column store for one MR direction, with named boolean masks and zero-copy masked views
+    '''
+    def __init__(self, columns: dict, masks: dict = None, attrs: dict = None, selector: np.ndarray = None):
+        self._columns = columns
+        self._masks = {} if masks is None else masks
+        self.attrs = {} if attrs is None else attrs
+        self._selector = selector
+        self._nrows = len(next(iter(columns.values()))) if columns else 0
+        if 'proxy' not in self._masks and {'rsid_x', 'rsid_y'} <= set(columns):
+            self._masks['proxy'] = np.asarray(columns['rsid_x'] != columns['rsid_y'], dtype=bool)
+
+    @property
+    def is_view(self) -> bool:
+        '''
+        Masked views share attrs with their full data, so anything cached in attrs describes the full data only
+        '''
+        return self._selector is not None
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame):
+        '''
+        Convert an analytic dataframe: bool columns become masks, numeric columns float64 arrays and anything else object arrays
+        '''
+        columns, masks = {}, {}
+        for col in data.columns:
+            if pd.api.types.is_bool_dtype(data[col]):
+                masks[col] = data[col].to_numpy(dtype=bool)
+            elif pd.api.types.is_numeric_dtype(data[col]):
+                columns[col] = np.ascontiguousarray(data[col].to_numpy(dtype=float))
+            else:
+                columns[col] = data[col].to_numpy(dtype=object)
+        return cls(columns, masks, dict(data.attrs))
+
+    def to_frame(self) -> pd.DataFrame:
+        data = pd.DataFrame({**{col: self[col] for col in self._columns}, **{name: self[name] for name in self._masks}}, index=self.index)
+        data.attrs = dict(self.attrs)
+        return data
+
+    @property
+    def index(self) -> np.ndarray:
+        '''
+        Row positions in the full (unfiltered) data, so results from views can be matched back to the parent
+        '''
+        return np.arange(self._nrows) if self._selector is None else np.flatnonzero(self._selector)
+
+    @property
+    def columns(self) -> list:
+        return [*self._columns, *self._masks]
+
+    @property
+    def masks(self) -> list:
+        return list(self._masks)
+
+    def __len__(self) -> int:
+        return self._nrows if self._selector is None else int(self._selector.sum())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._columns or key in self._masks
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            values = self._columns[key] if key in self._columns else self._masks[key]
+            return values if self._selector is None else values[self._selector]
+        return self.view(key)
+
+    def __setitem__(self, key: str, values):
+        if self._selector is not None:
+            raise TypeError('Masked views are read-only; set columns on the parent AnalyticData')
+        values = np.asarray(values)
+        if len(values) != self._nrows:
+            raise ValueError(f'Column {key} has length {len(values)}, expected {self._nrows}')
+        if values.dtype == bool:
+            self._columns.pop(key, None)
+            self._masks[key] = values
+        else:
+            self._masks.pop(key, None)
+            self._columns[key] = np.ascontiguousarray(values, dtype=float)
+
+    def view(self, mask: np.ndarray):
+        '''
+        Masked view of the rows where mask is True; mask has the length of this (possibly already filtered) data
+        '''
+        mask = np.asarray(mask, dtype=bool)
+        if self._selector is None:
+            selector = mask
+        else:
+            selector = np.zeros(self._nrows, dtype=bool)
+            selector[np.flatnonzero(self._selector)[mask]] = True
+        return AnalyticData(self._columns, self._masks, self.attrs, selector)
@@ -0,0 +1,102 @@
+'''
+Univariable MR for one exposure against many outcomes at once, with outcomes stacked as columns of 2-D arrays
+'''
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+from .models import wls, steig, het
+
+# Inputs share one set of instruments (rows): exposure arrays are (n,) and outcome arrays are (n, m)
+# Missing outcome values (NaN beta_y or se_y) are masked by zero weights, so every outcome is fitted from the same arrays
+# with no per-outcome loop or subsetting; filtered fits (Steiger, radial) likewise zero the weights of flagged variants
+# Models mirror uni.run_analyses (without the weighted median): IVW and Egger weighted by se_y**-2, unweighted radial IVW and
+# Egger on ratio_z ~ ratio_inv_se, radial outliers by Cochran's or Rucker's Q p < 0.05, and Steiger flags from the fast
+# beta/se path in models.steig
+# Internally arrays are (m, n) so that models.wls sums run over instruments on the last axis; outputs are returned as (n, m)
+# Per-model results are dicts of (m,) arrays; per-variant statistics are (n, m) arrays, NaN (or False) where masked
+
+def solve(x, y, w, intercept=False) -> dict:
+    '''
+    Slope (and intercept) estimates, SEs and p-values for every outcome from masked weighted sums
+    '''
+    sol = wls.solve_sums(wls.calc_sums(x, y, w), intercept)
+    res = {'beta': sol['beta'], 'se': sol['se'], 'pval': wls.calc_pvals(sol['beta'], sol['se'], sol['df']), 'nvar': sol['df'] + (2 if intercept else 1)}
+    if intercept:
+        res.update({'intercept': sol['alpha'], 'intercept_se': sol['alpha_se'], 'intercept_pval': wls.calc_pvals(sol['alpha'], sol['alpha_se'], sol['df'])})
+    return res
+
+def summarise_q(qstats: np.ndarray) -> dict:
+    q, pval, i2 = het.calc_summary_heterogeneity_statistics(qstats)
+    return {'q': q, 'q_pval': pval, 'i2': i2}
+
+def run_matrix(beta_x, se_x, n_x, beta_y, se_y, n_y, alpha=0.05) -> dict:
+    '''
+    Run IVW, Egger, radial and filtered models plus Q statistics and Steiger flags for all outcome columns of beta_y
+    n_x may be scalar or (n,); n_y may be scalar, (m,) or (n, m)
+    Return {'models': {model: {...}}, 'variants': {statistic: (n, m) array}}
+    '''
+    bx, sx = np.asarray(beta_x, dtype=float), np.asarray(se_x, dtype=float)
+    by, sy = np.asarray(beta_y, dtype=float).T, np.asarray(se_y, dtype=float).T
+    nx = np.broadcast_to(np.asarray(n_x, dtype=float), bx.shape)
+    ny = np.asarray(n_y, dtype=float)
+    ny = np.broadcast_to(ny.T if ny.ndim == 2 else (ny[:, None] if ny.ndim == 1 else ny), by.shape)
+    observed = ~(np.isnan(by) | np.isnan(sy))
+    by, sy = np.where(observed, by, 0), np.where(observed, sy, 1)
+    x = np.broadcast_to(bx, by.shape)
+
+    # Ratio estimates with first-order SEs
+    ratio = by/x
+    ratio_se = sy/np.abs(x)
+    ratio_z, ratio_inv_se = ratio/ratio_se, ratio_se**-1
+    w = np.where(observed, sy**-2, 0)
+    unit = observed.astype(float)
+
+    models = {'ivw': solve(x, by, w), 'egger': solve(x, by, w, intercept=True),
+              'radial': solve(ratio_inv_se, ratio_z, unit), 'egger_radial': solve(ratio_inv_se, ratio_z, unit, intercept=True)}
+
+    # Per-variant heterogeneity on the radial scale (het module, Bowden 2018 Box 4), then radial outlier flags
+    cochranq_radial = (ratio_z - models['radial']['beta'][:, None]*ratio_inv_se)**2
+    ruckerq_radial = (ratio_z - models['egger_radial']['intercept'][:, None] - models['egger_radial']['beta'][:, None]*ratio_inv_se)**2
+    radial_fail = observed & ((chi2.sf(cochranq_radial, 1) < alpha) | (chi2.sf(ruckerq_radial, 1) < alpha))
+    models['ivw_radial_filtered'] = solve(x, by, np.where(radial_fail, 0, w))
+    models['egger_radial_filtered'] = solve(x, by, np.where(radial_fail, 0, w), intercept=True)
+
+    # Steiger flags use the vectorised Wald F path, broadcasting exposure statistics across outcomes
+    steiger_fail = observed & steig.calc_steiger_flags(steig.calc_f_fast(nx, bx, sx), nx, steig.calc_f_fast(ny, by, sy), ny, ratio_z)
+    models['ivw_steig_filtered'] = solve(x, by, np.where(steiger_fail, 0, w))
+
+    variants = {
+        'observed': observed,
+        'steiger_fail': steiger_fail,
+        'radial_fail': radial_fail,
+        'cochranq_ivw': np.where(observed, ratio_se**-2*(ratio - models['ivw']['beta'][:, None])**2, np.nan),
+        'cochranq_radial': np.where(observed, cochranq_radial, np.nan),
+        'ruckerq_radial': np.where(observed, ruckerq_radial, np.nan),
+        'cochranq_ivw_radial_filtered': np.where(observed & ~radial_fail, ratio_se**-2*(ratio - models['ivw_radial_filtered']['beta'][:, None])**2, np.nan)
+    }
+    for model, qstat in [('ivw', 'cochranq_ivw'), ('radial', 'cochranq_radial'), ('egger_radial', 'ruckerq_radial'), ('ivw_radial_filtered', 'cochranq_ivw_radial_filtered')]:
+        models[model].update(summarise_q(variants[qstat]))
+    return {'models': models, 'variants': {key: value.T for key, value in variants.items()}}
+
+def stack_outcomes(frames: list) -> dict:
+    '''
+    Align analytic data for one exposure against many outcomes on rsid_x, returning the keyword arguments for run_matrix plus rsids
+    Instruments missing for an outcome are left as NaN, to be masked
+    '''
+    rsids = pd.unique(np.concatenate([np.asarray(frame['rsid_x'], dtype=object) for frame in frames]))
+    index = pd.Index(rsids)
+    stacked = {'rsid': rsids}
+    for col in ['beta_x', 'se_x', 'n_x']:
+        stacked[col] = np.full(len(rsids), np.nan)
+    for col in ['beta_y', 'se_y', 'n_y']:
+        stacked[col] = np.full((len(rsids), len(frames)), np.nan)
+    # Exposure statistics are identical across outcomes; fill in reverse so the first frame with each instrument wins
+    for j, frame in reversed(list(enumerate(frames))):
+        pos = index.get_indexer(np.asarray(frame['rsid_x'], dtype=object))
+        for col in ['beta_x', 'se_x', 'n_x']:
+            stacked[col][pos] = frame[col]
+        for col in ['beta_y', 'se_y', 'n_y']:
+            stacked[col][pos, j] = frame[col]
+    # Sample sizes only enter the Steiger calculation, where a missing value would propagate; those variants are masked anyway
+    stacked['n_y'] = np.where(np.isnan(stacked['n_y']), 1, stacked['n_y'])
+    return stacked
@@ -6,9 +6,10 @@ import statsmodels
 import pandas as pd
 import numpy as np
 from scipy.stats import chi2
+from . import wls
 
 # Logic here is based on Bowden 2018 and the source code for the accompanying RadialMR R package (lines are permalinked)
-# The RadialMR package uses iterative radial regressions, but this is not mentioned in the originating paper, so it is not implemented here 
+# The RadialMR package uses iterative radial regressions, but this is not mentioned in the originating paper, so it is only an option here (run_iterative_radial)
 # Many definitions of weights can be used, but using 'first order' inverse variance here throughout for simplicity
 # Q statistics follow a chi2 distribution, and p-values are attained using R's pchisq(lower.tail=FALSE); inverse CDF
 # chi2.sf() == survival function == 1-CDF is the equivalent: https://albertotb.com/Equivalence-between-distribution-functions-in-R-and-Python/ 
@@ -21,29 +22,91 @@ def calc_cochranq_per_variant(data: pd.DataFrame, fitted_beta: float, return_pva
     # Bowden 2018, Box 4 equation 2: normal Q statistic (weighted sum of squared mean differences)
     # https://github.com/WSpiller/RadialMR/blob/abe00170076284cb79ae711c96d3832da3879267/R/ivw_radial.R#L402
     cochranq = (data['ratio_se']**-2) * (data['ratio']-fitted_beta)**2
-    cochranp = chi2.sf(cochranq, 1)
     if return_pvals:
-        return cochranq, cochranp
+        return cochranq, chi2.sf(cochranq, 1)
     return cochranq
 
-def calc_ruckerq_per_variant(data: pd.DataFrame, eggrad_res):
+def calc_ruckerq_per_variant(data: pd.DataFrame, eggrad_res, return_pvals=True):
     '''
     Calculate row-wise Rucker's Q from radial Egger
     '''
     # Bowden 2018, Box 4 equation 4
     ruckerq = (data['ratio_se']**-2) * (data['ratio']-(eggrad_res.params['Intercept']/data['ratio_se']**-1)-eggrad_res.params['ratio_inv_se'])**2
-    ruckerp = chi2.sf(ruckerq, 1)
-    return ruckerq, ruckerp
+    if return_pvals:
+        return ruckerq, chi2.sf(ruckerq, 1)
+    return ruckerq
 
-def calc_summary_heterogeneity_statistics(qstats: pd.Series):
+def calc_summary_heterogeneity_statistics(qstats):
     '''
     Given an array of variant-wise Q statistics, return the summary Q statistics, its p-value and corresponding I2
+    NaN entries (variants excluded from the fitted model) are dropped before counting
+    A 2-D array is summarised along its last axis, giving one set of statistics per row
     '''
-    q = qstats.sum()
-    pval = chi2.sf(q, len(qstats)-1) # one-sided
-    i2 = 100*((q-(len(qstats)-1))/q)
+    qstats = np.asarray(qstats, dtype=float)
+    q = np.nansum(qstats, axis=-1)
+    nvar = np.sum(~np.isnan(qstats), axis=-1)
+    pval = chi2.sf(q, nvar-1) # one-sided
+    with np.errstate(divide='ignore', invalid='ignore'):
+        i2 = 100*((q-(nvar-1))/q)
     return q, pval, i2
 
-    
-    
-    
\ No newline at end of file
+def summarise_ragged(qstats: np.ndarray, offsets: np.ndarray, return_pvals=True) -> dict:
+    '''
+    Summary Q, p-value, I2 and variant count per segment, plus per-variant p-values unless return_pvals is False,
+    from flat Q statistics split by offsets
+    NaN entries are dropped as in calc_summary_heterogeneity_statistics
+    '''
+    # Segment sums use np.add.reduceat; a trailing zero keeps the start index of empty final segments in range,
+    # and empty segments (where reduceat returns the next element instead) are zeroed
+    # Per-variant and summary p-values share a single chi2.sf call
+    qstats = np.asarray(qstats, dtype=float)
+    offsets = np.asarray(offsets)
+    starts, counts = offsets[:-1], np.diff(offsets)
+    observed = ~np.isnan(qstats)
+    q = np.where(counts > 0, np.add.reduceat(np.append(np.where(observed, qstats, 0), 0), starts), 0)
+    nvar = np.where(counts > 0, np.add.reduceat(np.append(observed, False).astype(int), starts), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        i2 = 100*((q-(nvar-1))/q)
+    if not return_pvals:
+        return {'q': q, 'q_pval': chi2.sf(q, nvar-1), 'i2': i2, 'nvar': nvar}
+    pvals = chi2.sf(np.concatenate([qstats, q]), np.concatenate([np.ones(len(qstats)), nvar-1]))
+    return {'pval': pvals[:len(qstats)], 'q': q, 'q_pval': pvals[len(qstats):], 'i2': i2, 'nvar': nvar}
+
+def get_summary_heterogeneity_statistics(data, column: str):
+    '''
+    Summary Q, p-value and I2 for a per-variant Q column, read from data.attrs['heterogeneity'] if already summarised there
+    The cache describes full data only, so masked views are always recomputed
+    '''
+    cached = {} if getattr(data, 'is_view', False) else data.attrs.get('heterogeneity', {})
+    if column in cached:
+        return cached[column]
+    return calc_summary_heterogeneity_statistics(data[column])
+
+def run_iterative_radial(data: pd.DataFrame, alpha=0.05, maxiter=100) -> dict:
+    '''
+    Repeatedly flag radial outliers (Cochran's or Rucker's Q p < alpha) and refit without them until no new outliers are found
+    Return the boolean mask of removed variants, the number of iterations taken and whether no outliers remain (converged)
+    Iteration stops unconverged, leaving the last outliers found unremoved, at maxiter or if removal would leave fewer than 3 variants
+    '''
+    # Radial fits are unweighted regressions of ratio_z on ratio_inv_se, so both are solved from the same sums (models.wls)
+    # Removing outliers downdates the sums by their terms only, rather than refitting on the remaining data
+    # On the radial scale ratio_se**-2 * (ratio - beta)**2 == (ratio_z - beta*ratio_inv_se)**2, matching the per-variant functions above
+    x, y = np.asarray(data['ratio_inv_se'], dtype=float), np.asarray(data['ratio_z'], dtype=float)
+    terms = wls.calc_terms(x, y)
+    sums = {key: term.sum() for key, term in terms.items()}
+    removed = np.zeros(len(x), dtype=bool)
+    converged = False
+    for iteration in range(1, maxiter+1):
+        ivw, egger = wls.solve_sums(sums), wls.solve_sums(sums, intercept=True)
+        cochranp = chi2.sf((y - ivw['beta']*x)**2, 1)
+        ruckerp = chi2.sf((y - egger['alpha'] - egger['beta']*x)**2, 1)
+        failed = ~removed & ((cochranp < alpha) | (ruckerp < alpha))
+        if not failed.any():
+            converged = True
+            break
+        # Stop before the Egger fit becomes unidentified
+        if sums['n'] - failed.sum() < 3:
+            break
+        sums = wls.downdate(sums, terms, failed)
+        removed |= failed
+    return {'removed': removed, 'niter': iteration, 'converged': converged}
@@ -0,0 +1,32 @@
+'''
+Leave-one-variant-out IVW and Egger estimates from downdated weighted sums
+'''
+
+import pandas as pd
+import numpy as np
+from . import wls
+
+# Refitting with each variant dropped in turn is n fits of O(n) each
+# Instead the weighted sums are built once and each variant's own contribution is subtracted (models.wls.downdate),
+# so all n leave-one-out fits are solved together from an (n,) array of sums per term
+# SEs and p-values follow the same conventions as the full fits (scale from the residual sum of squares, t on n-k-1 DF)
+
+def run_loo(data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Return IVW and Egger estimates with each variant omitted, indexed by the omitted variant
+    '''
+    x, y = np.asarray(data['beta_x'], dtype=float), np.asarray(data['beta_y'], dtype=float)
+    terms = wls.calc_terms(x, y, np.asarray(data['se_y'], dtype=float)**-2)
+    loo = wls.downdate({key: term.sum() for key, term in terms.items()}, terms)
+    ivw, egger = wls.solve_sums(loo), wls.solve_sums(loo, intercept=True)
+    return pd.DataFrame({
+        'ivw_beta': ivw['beta'],
+        'ivw_se': ivw['se'],
+        'ivw_pval': wls.calc_pvals(ivw['beta'], ivw['se'], ivw['df']),
+        'egger_beta': egger['beta'],
+        'egger_se': egger['se'],
+        'egger_pval': wls.calc_pvals(egger['beta'], egger['se'], egger['df']),
+        'egger_intercept': egger['alpha'],
+        'egger_intercept_se': egger['alpha_se'],
+        'egger_intercept_pval': wls.calc_pvals(egger['alpha'], egger['alpha_se'], egger['df'])
+    }, index=data.index)
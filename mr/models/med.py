@@ -5,38 +5,65 @@ Functions to penalise first-order weights have been removed for now given limite
 
 import pandas as pd
 import numpy as np
-import robustats
-from scipy.stats import norm, bootstrap
-from statsmodels.formula import api as smf
+from scipy.stats import norm
+
+# Weighted median follows Bowden 2016 and the weighted_median function in the TwoSampleMR R package:
+# sort the ratios, standardise weights to sum to one, place each ratio at the midpoint of its cumulative weight step,
+# then interpolate between the two ratios whose midpoints straddle 0.5
+# All functions work on the last axis, so a (nboot, nvar) matrix of resampled variants is handled in one vectorised pass
+# Bootstrap resamples are drawn in chunks of rows to keep the index matrix bounded for large instrument sets
+MAX_BOOT_ELEMENTS = 2**22
 
 # ----->>>>> Subfunctions
 
-def get_weighted_median(sorted: pd.DataFrame) -> float:
-    # Easier to use full DF so that values are sorted together without additional processing
-    sorted['cumulative_weight'] = np.cumsum(sorted['ratio_se']**-2)
-    totalweight = (sorted['ratio_se']**-2).sum()
-    median_idx = sorted[sorted['cumulative_weight'] >= (totalweight/2)].index[0]
-    if totalweight%2==1:
-        return sorted['ratio'][median_idx]
-    return (sorted['ratio'][median_idx-1] + sorted['ratio'][median_idx+1])/2
-        
-def bootstrapped_se(sorted: pd.DataFrame) -> float:
-    # Can simply bootstrap the sorted vector of (ratio * weight) and calculate SE        
-    res = bootstrap(((sorted['ratio'] * sorted['ratio_se']**-2),), np.median, method='percentile')
-    return res.standard_error
+def get_weighted_median(ratio: np.ndarray, weight: np.ndarray) -> np.ndarray:
+    '''
+    Weighted median of ratio over the last axis, for a single vector or a matrix of resamples
+    '''
+    if ratio.shape[-1] < 2:
+        return ratio[..., 0]
+    order = np.argsort(ratio, axis=-1)
+    ratio = np.take_along_axis(ratio, order, axis=-1)
+    weight = np.take_along_axis(weight, order, axis=-1)
+    weight = weight/weight.sum(axis=-1, keepdims=True)
+    cumulative = np.cumsum(weight, axis=-1) - 0.5*weight
+    # Index of the last midpoint below 0.5, clipped so that there is always a point above to interpolate towards
+    below = np.clip(np.sum(cumulative < 0.5, axis=-1, keepdims=True) - 1, 0, ratio.shape[-1]-2)
+    lo, hi = np.take_along_axis(ratio, below, axis=-1), np.take_along_axis(ratio, below+1, axis=-1)
+    clo, chi = np.take_along_axis(cumulative, below, axis=-1), np.take_along_axis(cumulative, below+1, axis=-1)
+    return (lo + (hi-lo)*(0.5-clo)/(chi-clo))[..., 0]
+
+def bootstrapped_se(ratio: np.ndarray, weight: np.ndarray, nboot=1000, seed=None) -> float:
+    '''
+    Standard error of the weighted median from nboot resamples of variants with replacement
+    Passing a seed (or a np.random.Generator) makes the SE reproducible
+    With fewer than two variants or resamples there is no spread to estimate, so the SE is NaN
+    '''
+    # A single variant gives identical resamples, whose std is rounding noise rather than zero
+    if len(ratio) < 2 or nboot < 2:
+        return np.nan
+    rng = np.random.default_rng(seed)
+    chunksize = max(1, MAX_BOOT_ELEMENTS//max(len(ratio), 1))
+    estimates = []
+    for start in range(0, nboot, chunksize):
+        idx = rng.integers(0, len(ratio), size=(min(chunksize, nboot-start), len(ratio)))
+        estimates.append(get_weighted_median(ratio[idx], weight[idx]))
+    return np.std(np.concatenate(estimates), ddof=1)
 
-# ----->>>>> Function 
+# ----->>>>> Function
 
-def run_wm(data: pd.DataFrame) -> dict:
-    ''' 
-    Weighted median MR with specified weights
+def run_wm(data: pd.DataFrame, nboot=1000, seed=None) -> dict:
     '''
-    sorted = data.sort_values('ratio').reset_index(drop=True)
+    Weighted median MR with first-order inverse variance weights
+    nboot trades precision of the bootstrapped SE against cost; seed fixes the resamples
+    '''
+    ratio = np.asarray(data['ratio'], dtype=float)
+    weight = np.asarray(data['ratio_se'], dtype=float)**-2
+    beta = float(get_weighted_median(ratio, weight))
+    se = bootstrapped_se(ratio, weight, nboot, seed)
     return {
-        'beta': get_weighted_median(sorted),
-        'se': bootstrapped_se(sorted),
+        'beta': beta,
+        'se': se,
         'nvar': len(data),
-        'pval': 2 * norm.sf(np.abs(get_weighted_median(sorted)/bootstrapped_se(sorted)))
+        'pval': 2 * norm.sf(np.abs(beta/se))
     }
-  
-
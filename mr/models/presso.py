@@ -0,0 +1,67 @@
+'''
+MR-PRESSO global and outlier tests, with leave-one-out fits solved in closed form for whole batches of simulated datasets
+'''
+
+import pandas as pd
+import numpy as np
+from . import wls
+
+# Tests follow Verbanck 2018 and the mr_presso function in the MRPRESSO R package (distortion test not implemented):
+#   - observed RSS: each variant's outcome beta is compared with the IVW estimate fitted without it, weighted by se_y**-2
+#   - simulated data: exposure betas drawn from N(beta_x, se_x), outcome betas from N(beta_x*loo_beta, se_y)
+#   - global p-value: share of simulated RSS (with their own leave-one-out fits) above the observed RSS
+#   - outlier p-value: share of simulated squared residuals (against the observed leave-one-out fit) above the observed one,
+#     Bonferroni-corrected over variants; variants are only flagged as outliers if the global test is significant
+# The R package refits lm() n times per simulated dataset; here every leave-one-out IVW fit comes from downdating the
+# weighted sums (models.wls), so a chunk of simulations is a handful of (chunk, nvar) array operations
+# Simulations are drawn in chunks of rows to keep memory bounded, as for the weighted median bootstrap (models.med)
+# All draws for a simulation are taken together, so results for a given seed do not depend on the chunk size
+# p-values cannot be smaller than 1/nsim, so nsim should exceed nvar/alpha for any outlier to be detectable
+MAX_SIM_ELEMENTS = 2**20
+
+def calc_loo_beta(x: np.ndarray, y: np.ndarray, w: np.ndarray) -> np.ndarray:
+    '''
+    IVW slope with each variant left out in turn, over the last axis
+    '''
+    # Only the two sums the IVW slope needs are downdated (wls.solve_sums without an intercept: wxy/wxx), 
+    # since the full set of terms for a chunk of simulations would multiply its memory
+    terms = {'wxx': w*x*x, 'wxy': w*x*y}
+    loo = wls.downdate({key: np.sum(term, axis=-1) for key, term in terms.items()}, terms)
+    return loo['wxy']/loo['wxx']
+
+def calc_rss(x: np.ndarray, y: np.ndarray, w: np.ndarray, loo_beta: np.ndarray) -> np.ndarray:
+    return np.sum(w*(y - loo_beta*x)**2, axis=-1)
+
+def run_presso(data: pd.DataFrame, nsim=1000, seed=None, chunksize=None, alpha=0.05) -> dict:
+    '''
+    MR-PRESSO global test and per-variant outlier test on nsim simulated datasets
+    chunksize is the number of simulations held in memory at once (by default sized from MAX_SIM_ELEMENTS); seed fixes the draws
+    Return the observed RSS, global p-value, Bonferroni-corrected outlier p-values and the boolean outlier mask
+    '''
+    bx, by = np.asarray(data['beta_x'], dtype=float), np.asarray(data['beta_y'], dtype=float)
+    sx, sy = np.asarray(data['se_x'], dtype=float), np.asarray(data['se_y'], dtype=float)
+    w = sy**-2
+    nvar = len(bx)
+    loo_beta = calc_loo_beta(bx, by, w)
+    rss = calc_rss(bx, by, w, loo_beta)
+    dif = (by - loo_beta*bx)**2
+
+    rng = np.random.default_rng(seed)
+    chunksize = max(1, MAX_SIM_ELEMENTS//max(nvar, 1)) if chunksize is None else chunksize
+    exceed_rss, exceed_dif = 0, np.zeros(nvar)
+    for start in range(0, nsim, chunksize):
+        draws = rng.standard_normal((min(chunksize, nsim-start), 2, nvar))
+        sim_bx = bx + sx*draws[:, 0]
+        sim_by = loo_beta*bx + sy*draws[:, 1]
+        exceed_rss += np.sum(calc_rss(sim_bx, sim_by, w, calc_loo_beta(sim_bx, sim_by, w)) > rss)
+        exceed_dif += np.sum((sim_by - loo_beta*sim_bx)**2 > dif, axis=0)
+
+    pval = exceed_rss/nsim
+    outlier_pval = np.minimum(exceed_dif/nsim*nvar, 1)
+    return {
+        'rss': rss,
+        'pval': pval,
+        'nsim': nsim,
+        'outlier_pval': outlier_pval,
+        'outliers': (outlier_pval < alpha) if pval < alpha else np.zeros(nvar, dtype=bool)
+    }
@@ -0,0 +1,126 @@
+'''
+Closed-form weighted least squares for the single-exposure regressions used in MR (IVW, Egger and their radial forms)
+Replaces statsmodels formula fits, where building the patsy design matrix and full RegressionResults dominates runtime
+'''
+
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from scipy.stats import t
+
+# Only two designs are ever needed: slope through the origin (IVW, IVW-radial) and slope plus intercept (Egger, Egger-radial)
+# Both have analytic solutions in terms of a handful of weighted sums, so no matrix inversion is needed
+# Results mirror the statsmodels WLS conventions so they are interchangeable in plotting and heterogeneity code:
+#   - scale is the weighted residual sum of squares over df_resid (n - number of parameters)
+#   - p-values are two-sided from the t distribution on df_resid
+#   - the intercept term is named 'Intercept' and comes first, as patsy orders it
+# Sums are taken over the last axis, so the same functions work for a single fit or a stack of fits
+# Because the fits depend on the data only through the sums, removing a variant is an O(1) downdate of its own terms
+
+@dataclass
+class WLSResult:
+    '''
+    Lightweight stand-in for statsmodels RegressionResults, holding only what MR code consumes
+    '''
+    params: pd.Series
+    bse: pd.Series
+    pvalues: pd.Series
+    fittedvalues: pd.Series
+    resid: pd.Series
+    nobs: int
+    df_resid: int
+    scale: float
+
+    @property
+    def tvalues(self) -> pd.Series:
+        return self.params/self.bse
+
+def calc_terms(x: np.ndarray, y: np.ndarray, w: np.ndarray = None) -> dict:
+    '''
+    Per-observation contributions to each weighted sum, so that observations can later be removed from the sums
+    '''
+    w = np.ones_like(x) if w is None else w
+    return {
+        'n': (w != 0).astype(int),
+        'w': w,
+        'wx': w*x,
+        'wy': w*y,
+        'wxx': w*x*x,
+        'wxy': w*x*y,
+        'wyy': w*y*y
+    }
+
+def calc_sums(x: np.ndarray, y: np.ndarray, w: np.ndarray = None) -> dict:
+    '''
+    Calculate the weighted sums over the last axis that fully determine both the IVW and Egger fits
+    '''
+    return {key: np.sum(term, axis=-1) for key, term in calc_terms(x, y, w).items()}
+
+def downdate(sums: dict, terms: dict, mask: np.ndarray = None) -> dict:
+    '''
+    Remove observations from the sums without touching the remaining data
+    With a mask, drop all masked observations at once; without one, return the leave-one-out sums for every observation on a new last axis
+    '''
+    if mask is not None:
+        return {key: sums[key] - np.sum(np.where(mask, terms[key], 0), axis=-1) for key in sums}
+    return {key: np.expand_dims(sums[key], -1) - terms[key] for key in sums}
+
+def solve_sums(sums: dict, intercept=False) -> dict:
+    '''
+    Solve the normal equations from weighted sums
+    Return slope and intercept (zero if not fitted) with their unscaled variances, SEs, residual sum of squares and residual DF
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if intercept:
+            det = sums['w']*sums['wxx'] - sums['wx']**2
+            beta = (sums['w']*sums['wxy'] - sums['wx']*sums['wy'])/det
+            alpha = (sums['wy'] - beta*sums['wx'])/sums['w']
+            beta_v, alpha_v = sums['w']/det, sums['wxx']/det
+            rss = sums['wyy'] - alpha*sums['wy'] - beta*sums['wxy']
+            df = sums['n'] - 2
+        else:
+            beta = sums['wxy']/sums['wxx']
+            alpha = np.zeros_like(beta)
+            beta_v, alpha_v = 1/sums['wxx'], np.zeros_like(beta)
+            rss = sums['wyy'] - beta*sums['wxy']
+            df = sums['n'] - 1
+        scale = rss/df
+        return {'beta': beta, 'alpha': alpha, 'beta_v': beta_v, 'alpha_v': alpha_v,
+                'se': np.sqrt(scale*beta_v), 'alpha_se': np.sqrt(scale*alpha_v),
+                'rss': rss, 'df': df}
+
+def calc_pvals(estimate, se, df):
+    '''
+    Two-sided p-value from the t distribution, as reported by statsmodels
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 2*t.sf(np.abs(estimate/se), df)
+
+def fit(x: pd.Series, y: pd.Series, weights: pd.Series = None, intercept=False, xname: str = None, index=None) -> WLSResult:
+    '''
+    Fit y ~ x (- 1 unless intercept) by weighted least squares; weights of None gives OLS
+    Parameter naming and the fittedvalues index follow x unless given, so results slot in where statsmodels formula fits were used
+    '''
+    xname = getattr(x, 'name', None) if xname is None else xname
+    index = getattr(x, 'index', None) if index is None else index
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    w = np.ones_like(x) if weights is None else np.asarray(weights, dtype=float)
+    sol = solve_sums(calc_sums(x, y, w), intercept)
+    fitted = sol['alpha'] + sol['beta']*x
+    resid = y - fitted
+    # Residuals are available here, so take the RSS directly rather than from the sums to avoid cancellation on near-perfect fits
+    scale = np.sum(w*resid**2)/sol['df'] if sol['df'] > 0 else np.nan
+    bse_beta, bse_alpha = np.sqrt(scale*sol['beta_v']), np.sqrt(scale*sol['alpha_v'])
+    names = ['Intercept', xname] if intercept else [xname]
+    params = [sol['alpha'], sol['beta']] if intercept else [sol['beta']]
+    bse = [bse_alpha, bse_beta] if intercept else [bse_beta]
+    return WLSResult(
+        params=pd.Series(params, index=names, dtype=float),
+        bse=pd.Series(bse, index=names, dtype=float),
+        pvalues=pd.Series(calc_pvals(np.array(params), np.array(bse), sol['df']), index=names, dtype=float),
+        fittedvalues=pd.Series(fitted, index=index),
+        resid=pd.Series(resid, index=index),
+        nobs=len(x),
+        df_resid=int(sol['df']),
+        scale=scale
+    )
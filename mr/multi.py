@@ -0,0 +1,111 @@
+'''
+Top-level module to run multivariable MR models (MV-IVW and MV-Egger) for one exposure set against many outcomes
+'''
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_factor, cho_solve
+from scipy.stats import chi2
+from .models import wls
+
+# Inputs are arrays over instruments (rows): bx (n, k) exposure betas shared by every outcome, by (n, m) outcome betas,
+# and either se_y (n, m) outcome SEs, giving first-order weights se_y**-2, or explicit weights of shape (n,) or (n, m)
+# Missing outcome values (NaN in by or its weight) are given zero weight for that outcome only
+# The exposure design is handled once for all outcomes:
+#   - with one weight vector shared by all outcomes (and no missingness) X'WX is Cholesky-factorised once and every outcome solved against it
+#   - with per-outcome weights, the per-instrument outer products x_i x_i' are formed once, so each outcome's X'WX is one
+#     row of a single (m, n) @ (n, k*k) matrix product, and all k x k systems are solved as one batched inversion
+# Scale, SEs and t-based p-values follow the univariable fits (models.wls); the weighted residual sum of squares is
+# also Cochran's Q for that outcome, on n - k degrees of freedom (n - k - 1 for MV-Egger)
+# MV-Egger follows Rees 2017: instruments are oriented so that the first exposure's betas are positive, then an intercept is added
+# Conditional F-statistics follow Sanderson 2021 (strength_mvmr in the MVMR R package), ignoring covariance between exposure estimates
+
+def get_weights(by: np.ndarray, se_y: np.ndarray = None, weights: np.ndarray = None):
+    '''
+    Return outcome betas with missing values zeroed, and weights as a shared (n,) vector where possible, otherwise (n, m)
+    '''
+    weights = se_y**-2 if weights is None else np.asarray(weights, dtype=float)
+    missing = np.isnan(by) | np.isnan(weights if weights.ndim == 2 else weights[:, None])
+    if missing.any():
+        weights = np.where(missing, 0, np.broadcast_to(weights if weights.ndim == 2 else weights[:, None], by.shape))
+    return np.where(missing, 0, by), weights
+
+def fit_batched(X: np.ndarray, Y: np.ndarray, W: np.ndarray) -> dict:
+    '''
+    Weighted least squares of every column of Y on the shared design X, with weights W of shape (n,) or (n, m)
+    Return coefficients (m, p) with SEs and p-values, plus residual sum of squares, observations and residual DF per outcome
+    '''
+    n, p = X.shape
+    if W.ndim == 1:
+        factor = cho_factor(X.T @ (W[:, None]*X))
+        beta = cho_solve(factor, X.T @ (W[:, None]*Y)).T
+        unscaled = np.broadcast_to(np.diag(cho_solve(factor, np.eye(p))), beta.shape)
+        W = np.broadcast_to(W[:, None], Y.shape)
+    else:
+        outer = (X[:, :, None]*X[:, None, :]).reshape(n, p*p)
+        inverse = np.linalg.inv((W.T @ outer).reshape(-1, p, p))
+        beta = np.einsum('mij,mj->mi', inverse, (W*Y).T @ X)
+        unscaled = np.diagonal(inverse, axis1=1, axis2=2)
+    rss = np.sum(W*(Y - X @ beta.T)**2, axis=0)
+    nobs = np.sum(W != 0, axis=0)
+    df = nobs - p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se = np.sqrt((rss/df)[:, None]*unscaled)
+    return {'beta': beta, 'se': se, 'pval': wls.calc_pvals(beta, se, df[:, None]), 'rss': rss, 'nvar': nobs, 'df': df}
+
+def summarise_fit(fit: dict, intercept=False) -> dict:
+    res = {'nvar': fit['nvar'], 'q': fit['rss'], 'q_df': fit['df'], 'q_pval': chi2.sf(fit['rss'], fit['df'])}
+    if intercept:
+        res.update({'intercept': fit['beta'][:, 0], 'intercept_se': fit['se'][:, 0], 'intercept_pval': fit['pval'][:, 0]})
+        return {**res, 'beta': fit['beta'][:, 1:], 'se': fit['se'][:, 1:], 'pval': fit['pval'][:, 1:]}
+    return {**res, 'beta': fit['beta'], 'se': fit['se'], 'pval': fit['pval']}
+
+def calc_conditional_f(bx: np.ndarray, se_x: np.ndarray) -> np.ndarray:
+    '''
+    Conditional F-statistic of each exposure given the others
+    '''
+    n, k = bx.shape
+    fstats = np.full(k, np.nan)
+    if k < 2:
+        return fstats
+    for j in range(k):
+        others = np.delete(np.arange(k), j)
+        delta = np.linalg.lstsq(bx[:, others], bx[:, j], rcond=None)[0]
+        q = np.sum((bx[:, j] - bx[:, others] @ delta)**2 / (se_x[:, j]**2 + se_x[:, others]**2 @ delta**2))
+        fstats[j] = q/(n - k + 1)
+    return fstats
+
+def run_mvmr(bx: np.ndarray, by: np.ndarray, se_y: np.ndarray = None, weights: np.ndarray = None, se_x: np.ndarray = None, egger=True) -> dict:
+    '''
+    Multivariable IVW (and MV-Egger) for every outcome column of by against the shared exposure matrix bx
+    Return a dict of per-model result dicts with (m, k) beta/se/pval and (m,) Q statistics, plus conditional F (k,) if se_x is given
+    '''
+    bx = np.asarray(bx, dtype=float)
+    bx = bx[:, None] if bx.ndim == 1 else bx
+    by = np.asarray(by, dtype=float)
+    by = by[:, None] if by.ndim == 1 else by
+    se_y = None if se_y is None else np.asarray(se_y, dtype=float).reshape(by.shape)
+    by, W = get_weights(by, se_y, weights)
+    res = {'ivw': summarise_fit(fit_batched(bx, by, W))}
+    if egger:
+        sign = np.where(bx[:, 0] < 0, -1.0, 1.0)
+        X = np.column_stack([np.ones(len(bx)), bx*sign[:, None]])
+        res['egger'] = summarise_fit(fit_batched(X, by*sign[:, None], W), intercept=True)
+    if se_x is not None:
+        res['fstat_cond'] = calc_conditional_f(bx, np.asarray(se_x, dtype=float).reshape(bx.shape))
+    return res
+
+def tabulate(res: dict, exposures: list, outcomes: list) -> pd.DataFrame:
+    '''
+    Long table with one row per (model, outcome, exposure) from the output of run_mvmr
+    '''
+    rows = []
+    for model in [m for m in ['ivw', 'egger'] if m in res]:
+        for i, outcome in enumerate(outcomes):
+            for j, exposure in enumerate(exposures):
+                row = {'model': model, 'outcome': outcome, 'exposure': exposure,
+                       **{key: res[model][key][i, j] for key in ['beta', 'se', 'pval']},
+                       **{key: res[model][key][i] for key in ['nvar', 'q', 'q_df', 'q_pval', 'intercept', 'intercept_se', 'intercept_pval'] if key in res[model]}}
+                if 'fstat_cond' in res:
+                    row['fstat_cond'] = res['fstat_cond'][j]
+                rows.append(row)
+    return pd.DataFrame(rows)
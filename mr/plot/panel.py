@@ -1,12 +1,24 @@
 import os
 from . import scatter
+from .. import timing
 import matplotlib.pyplot as plt
 
-def mr_panel(dataxy, datayx, resxy, resyx, outdir='.', outname=None):
+def mr_panel(dataxy, datayx, resxy, resyx, outdir='.', outname=None, rasterize=False):
     '''
     Wrapper to get 2x2 plot panel
+    With rasterize, point and errorbar layers are drawn as images, which keeps dense panels quick to save
+    If MR-PRESSO was run (presso_fail in the data), a third column shows the PRESSO-filtered fits for both directions
+    Return the path of the saved PNG
     '''
-    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(12,7.5))
+    with timing.stage('panel', len(dataxy) + len(datayx)):
+        return draw_panel(dataxy, datayx, resxy, resyx, outdir, outname, rasterize)
+
+def draw_panel(dataxy, datayx, resxy, resyx, outdir, outname, rasterize):
+    withpresso = 'presso_fail' in dataxy
+    if withpresso:
+        fig, ((ax1, ax2, ax5), (ax3, ax4, ax6)) = plt.subplots(2, 3, figsize=(18,7.5))
+    else:
+        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(12,7.5))
 
     # Top left (ax1) is the standard MR scatter with Steiger failures flagged
     # Plus main model and IWW (steiger-filtered) reglines
@@ -14,28 +26,44 @@ def mr_panel(dataxy, datayx, resxy, resyx, outdir='.', outname=None):
                       xlabel=dataxy.attrs['xname'], 
                       ylabel=dataxy.attrs['yname'],
                       title='Main Models',
-                      ax = ax1)
+                      ax = ax1, rasterize=rasterize)
     # Top right (ax2) is the radial plot with radial failures flagged and radial-scale reglines
     scatter.draw_plot(dataxy, xcol='ratio_inv_se', ycol='ratio_z', xerr=None, yerr=None, highlight='radial_fail', res=resxy,
                       xlabel='Inverse Ratio SE', 
                       ylabel='Ratio Z-score',
                       title='Radial Plot',
                       reglines=['radial','egger_radial'],
-                      ax=ax2)
+                      ax=ax2, rasterize=rasterize)
     # Bottom left (ax3) is standard scatter with radial failures flagged and radial-filtered reglines
     scatter.draw_plot(dataxy, xcol='beta_x', ycol='beta_y', xerr='se_x', yerr='se_y', highlight='radial_fail', res=resxy,
                       xlabel=dataxy.attrs['xname'], 
                       ylabel=dataxy.attrs['yname'],
                       title='Heterogeneity-filtered Models',
                       reglines=['ivw_radial_filtered','egger_radial_filtered'],
-                      ax=ax3)
+                      ax=ax3, rasterize=rasterize)
     # Bottom right (ax4) is the reverse MR standard scatter.  As for ax1 but inverting x and y
     scatter.draw_plot(datayx, xcol='beta_x', ycol='beta_y', xerr='se_x', yerr='se_y', highlight='steiger_fail', res=resyx,
                       xlabel=datayx.attrs['xname'], 
                       ylabel=datayx.attrs['yname'],
                       title='Reversed Main Models',
-                      ax = ax4)
+                      ax = ax4, rasterize=rasterize)
+    # Right column (ax5, ax6) is standard scatter with MR-PRESSO outliers flagged and the PRESSO-filtered IVW, for each direction
+    if withpresso:
+        for data, res, ax, title in [(dataxy, resxy, ax5, 'PRESSO-filtered Models'), (datayx, resyx, ax6, 'Reversed PRESSO-filtered Models')]:
+            if 'presso_fail' not in data:
+                ax.axis('off')
+                continue
+            scatter.draw_plot(data, xcol='beta_x', ycol='beta_y', xerr='se_x', yerr='se_y', highlight='presso_fail', res=res,
+                              xlabel=data.attrs['xname'], 
+                              ylabel=data.attrs['yname'],
+                              title=title,
+                              reglines=['ivw', 'ivw_presso_filtered'],
+                              ax=ax, rasterize=rasterize)
     plt.tight_layout()
     outname = f"{dataxy.attrs['xname'].lower().replace(': ','.')}.{dataxy.attrs['yname'].lower().replace(': ','.')}.unimr.plots" if outname is None else outname
-    plt.savefig(os.path.join(outdir, f'{outname}.png'), bbox_inches='tight')
+    outpath = os.path.join(outdir, f'{outname}.png')
+    plt.savefig(outpath, bbox_inches='tight')
+    # Close explicitly, since batch runs render many panels in one process
+    plt.close(fig)
+    return outpath
     
\ No newline at end of file
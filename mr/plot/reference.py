@@ -15,7 +15,8 @@ modelnames = {
     'egger_radial': 'Egger-Radial',
     'ivw_radial_filtered': 'IVW (radial-filtered)',
     'egger_radial_filtered': 'Egger (radial-filtered)',
-    'ivw_steig_filtered': 'IVW (Steiger-filtered)'
+    'ivw_steig_filtered': 'IVW (Steiger-filtered)',
+    'ivw_presso_filtered': 'IVW (PRESSO-filtered)'
 }
 
 plotcolours = {
@@ -26,5 +27,6 @@ plotcolours = {
     'egger_radial': 'forestgreen',
     'ivw_radial_filtered': 'royalblue',
     'egger_radial_filtered': 'forestgreen',
-    'ivw_steig_filtered': 'crimson'
+    'ivw_steig_filtered': 'crimson',
+    'ivw_presso_filtered': 'purple'
 }
\ No newline at end of file
@@ -0,0 +1,146 @@
+'''
+Rendering stage for the MR diagnostic panel, separated from modelling so that it can be skipped, filtered or deferred
+'''
+import os
+import pickle
+import tempfile
+import traceback
+import contextlib
+import matplotlib
+from concurrent.futures import ProcessPoolExecutor
+from .. import timing
+
+# Drawing and saving the panel often costs more than the models themselves, so rendering policy is held in a Renderer:
+#   - alpha: only render pairs where any of the given models has p < alpha in the x -> y direction (None renders everything)
+#   - deferred: instead of drawing in the calling process, save the data and results to a pickle and render it in a worker pool
+#   - rasterize_above: draw point and errorbar layers as images once a direction has more instruments than this
+# Workers always use the headless Agg backend; the calling process only switches to Agg when headless is set
+# As in batch.run_batch, deferred workers collect their timing records (under the labels active at submit) and return them,
+# and close() re-emits them to the calling process's sinks
+# The panel needs the default models and flags; pairs run with a subset of them (uni.run_analyses models/statistics) are skipped
+PANEL_MODELS = ['ivw', 'egger', 'wm', 'ivw_steig_filtered', 'radial', 'egger_radial', 'ivw_radial_filtered', 'egger_radial_filtered']
+PANEL_COLUMNS = ['steiger_fail', 'radial_fail', 'cochranq_ivw', 'cochranq_radial', 'ruckerq_radial', 'cochranq_ivw_radial_filtered']
+
+def use_headless():
+    matplotlib.use('Agg', force=True)
+
+def render(dataxy, datayx, resxy, resyx, outdir='.', outname=None, rasterize_above=1000) -> str:
+    '''
+    Draw and save the panel for one pair, returning the PNG path
+    '''
+    # Imported here so that the backend can be chosen before pyplot is first loaded in worker processes
+    from . import panel
+    rasterize = max(len(dataxy), len(datayx)) > rasterize_above
+    return panel.mr_panel(dataxy, datayx, resxy, resyx, outdir=outdir, outname=outname, rasterize=rasterize)
+
+def is_complete(data, res) -> bool:
+    '''
+    Whether one direction has every model and flag the panel draws
+    '''
+    return all(model in res for model in PANEL_MODELS) and all(column in data for column in PANEL_COLUMNS)
+
+def render_saved(path: str, outdir='.', outname=None, rasterize_above=1000, cleanup=True) -> str:
+    '''
+    Worker entry point: render the panel from a pickle written by save_results
+    '''
+    use_headless()
+    dataxy, datayx, resxy, resyx = load_results(path)
+    outpath = render(dataxy, datayx, resxy, resyx, outdir, outname, rasterize_above)
+    if cleanup:
+        os.remove(path)
+    return outpath
+
+def render_saved_safe(path: str, outdir='.', outname=None, rasterize_above=1000, labels=None, collect_timing=False) -> dict:
+    '''
+    Wrapper around render_saved for use in worker processes
+    Return a dict holding either the PNG path or the formatted traceback of the failure, plus any timing records
+    '''
+    with timing.labels(**(labels or {})), (timing.collect(exclusive=True) if collect_timing else contextlib.nullcontext([])) as records:
+        try:
+            return {'output': render_saved(path, outdir, outname, rasterize_above), 'error': None, 'timing': records}
+        except Exception:
+            return {'output': None, 'error': traceback.format_exc(), 'timing': records}
+
+def save_results(path: str, dataxy, datayx, resxy, resyx):
+    with open(path, 'wb') as f:
+        pickle.dump((dataxy, datayx, resxy, resyx), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_results(path: str):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+class Renderer:
+    '''
+    Rendering policy for a run: pass to uni.from_hdfpaths or batch.run_batch and call close() (or use as a context manager) when done
+    '''
+    def __init__(self, outdir='.', deferred=False, nworkers=None, alpha=None, models=('ivw',),
+                 rasterize_above=1000, headless=False, savedir=None):
+        self.outdir = outdir
+        self.alpha = alpha
+        self.models = models
+        self.rasterize_above = rasterize_above
+        self.futures = []
+        self.executor = ProcessPoolExecutor(max_workers=nworkers) if deferred else None
+        self.savedir = (savedir or tempfile.mkdtemp(prefix='epidmr-render-')) if deferred else None
+        self.cleanup_savedir = deferred and savedir is None
+        if headless:
+            use_headless()
+
+    def wanted(self, resxy: dict) -> bool:
+        '''
+        Significance filter on the x -> y results
+        '''
+        if self.alpha is None:
+            return True
+        return any(get_pval(resxy[model]) < self.alpha for model in self.models if model in resxy)
+
+    def submit(self, dataxy, datayx, resxy, resyx, outname=None):
+        '''
+        Render (or queue rendering of) one pair; return the PNG path when rendered synchronously, otherwise None
+        Pairs missing any model or flag the panel draws are skipped
+        '''
+        if not (is_complete(dataxy, resxy) and is_complete(datayx, resyx) and self.wanted(resxy)):
+            return None
+        if self.executor is None:
+            return render(dataxy, datayx, resxy, resyx, self.outdir, outname, self.rasterize_above)
+        path = os.path.join(self.savedir, f'{len(self.futures)}.pkl')
+        save_results(path, dataxy, datayx, resxy, resyx)
+        self.futures.append(self.executor.submit(render_saved_safe, path, self.outdir, outname, self.rasterize_above,
+                                                 timing.LABELS.get(), bool(timing.SINKS)))
+        return None
+
+    def close(self) -> list:
+        '''
+        Wait for deferred renders; return a list of (PNG path, None) or (None, traceback) per queued pair
+        Timing records from the workers are emitted here
+        '''
+        outcomes = []
+        for future in self.futures:
+            try:
+                out = future.result()
+            except Exception:
+                # e.g. a worker process that died
+                out = {'output': None, 'error': traceback.format_exc(), 'timing': []}
+            for record in out['timing']:
+                timing.emit(record)
+            outcomes.append((out['output'], out['error']))
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.cleanup_savedir and os.path.isdir(self.savedir) and not os.listdir(self.savedir):
+            os.rmdir(self.savedir)
+        self.futures = []
+        return outcomes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def get_pval(res) -> float:
+    '''
+    Slope p-value from either a regression result or the weighted median dict
+    '''
+    if isinstance(res, dict):
+        return res['pval']
+    return res.pvalues.iloc[-1]
@@ -1,19 +1,19 @@
 #import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
 from typing import Union
 from . import format, labels, text
 from .reference import fonts, plotcolours, modelnames
+from ..data import AnalyticData
 
-def plot_points(ax, x, y, xerr, yerr, colour='lightgrey', marker='.', size=3, width=.5):
+def plot_points(ax, x, y, xerr, yerr, colour='lightgrey', marker='.', size=3, width=.5, rasterize=False):
     '''
     Combine processes of plotting points and their error bars into one convenience function
     '''
-    ax.scatter(x, y, marker=marker, c=colour, s=size)
+    ax.scatter(x, y, marker=marker, c=colour, s=size, rasterized=rasterize)
     if not ((xerr is None) & (yerr is None)):
-        ax.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='none', ecolor=colour, elinewidth=width)
+        ax.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='none', ecolor=colour, elinewidth=width, rasterized=rasterize)
     
-def draw_plot(data: pd.DataFrame,
+def draw_plot(data: AnalyticData,
               xcol: str,
               ycol: str,
               xerr: Union[str, None],
@@ -24,52 +24,45 @@ def draw_plot(data: pd.DataFrame,
               ylabel: str,
               title: str,
               ax, 
-              reglines = ['ivw','egger','wm', 'ivw_steig_filtered']):
+              reglines = ['ivw','egger','wm', 'ivw_steig_filtered'],
+              rasterize=False):
     '''
     Multipurpose scatter plot
     To be used for both standard (filtered) MR plots and the radial plot
     '''
-    proxy = np.where(data['rsid_x']!=data['rsid_y'], True, False)
-    plot_points(ax, data[~proxy][xcol], data[~proxy][ycol], 
-                (data[~proxy][xerr] if xerr is not None else None), 
-                (data[~proxy][yerr] if yerr is not None else None))
-    plot_points(ax, data[proxy][xcol], data[proxy][ycol], 
-                (data[proxy][xerr] if xerr is not None else None), 
-                (data[proxy][yerr] if yerr is not None else None), 
-                marker='s')
+    # Read each plotted column once and subset the arrays by mask, rather than building filtered copies of the data per group
+    xvals, yvals = data[xcol], data[ycol]
+    xe = data[xerr] if xerr is not None else None
+    ye = data[yerr] if yerr is not None else None
+    proxy = data['proxy']
+    flagged = data[highlight] if highlight is not None else np.zeros(len(data), dtype=bool)
+    groups = [(~proxy, 'lightgrey', '.'), (proxy, 'lightgrey', 's')]
     if highlight is not None:
-        plot_points(ax, data[((~proxy) & (data[highlight]))][xcol], data[((~proxy) & (data[highlight]))][ycol],
-                    (data[((~proxy) & (data[highlight]))][xerr] if xerr is not None else None), 
-                    (data[((~proxy) & (data[highlight]))][yerr] if yerr is not None else None), 
-                    colour='indianred')
-        plot_points(ax, data[((proxy) & (data[highlight]))][xcol], data[((proxy) & (data[highlight]))][ycol],
-                    (data[((proxy) & (data[highlight]))][xerr] if xerr is not None else None), 
-                    (data[((proxy) & (data[highlight]))][yerr] if yerr is not None else None), 
-                    colour='indianred', marker='s')
+        groups += [((~proxy) & flagged, 'indianred', '.'), (proxy & flagged, 'indianred', 's')]
+    for mask, colour, marker in groups:
+        plot_points(ax, xvals[mask], yvals[mask], 
+                    (xe[mask] if xe is not None else None), 
+                    (ye[mask] if ye is not None else None), 
+                    colour=colour, marker=marker, rasterize=rasterize)
     
     # Overlay specified model lines
     for model in [x for x in reglines if not ((x=='wm') | ('filtered' in x))]:
-        ax.plot(data[xcol], res[model].fittedvalues, linewidth=1, 
+        ax.plot(xvals, res[model].fittedvalues, linewidth=1, 
                 label=labels.generate_legend_label(res[model], model), 
                 color=plotcolours[model])
     # Because we are subsetting data, lines drawn with the fitted values can look chaotic as they jump around the x axis
+    # Filtered fits are indexed by row position in the full data, so the matching x values are picked out by that index
     for model in [x for x in reglines if 'filtered' in x]:
-        plotdata = data[~data[highlight]]
         fitted = res[model].fittedvalues
-        ax.plot(plotdata[xcol], fitted[fitted.index.isin(plotdata.index)], linewidth=1, 
+        ax.plot(xvals[fitted.index.to_numpy()], fitted, linewidth=1, 
                 label=labels.generate_legend_label(res[model], model), 
                 color=plotcolours[model])
     if 'wm' in reglines:
-        ax.plot(data[xcol], np.abs(res['wm']['beta']*data[ycol].sort_values()), linewidth=1, 
+        ax.plot(xvals, np.abs(res['wm']['beta']*np.sort(yvals)), linewidth=1, 
                 label=labels.generate_legend_label_wm(res['wm']), 
-                color=plotcolours[model])
+                color=plotcolours['wm'])
 
     format.style_axes(xlabel, ylabel, title, ax)
     format.add_horizontal_zeroline(ax)
     format.add_legend(ax)
     format.add_textbox(text.get_variant_counts(data, highlight), text.get_qstats(data, reglines), ax)
-    
-
-
-
-    
\ No newline at end of file
@@ -2,28 +2,35 @@
 Generate text to be included in plot area
 '''
 
-import pandas as pd
 from ..models import het
+from ..data import AnalyticData
 
-def get_variant_counts(data: pd.DataFrame, highlight: str) -> str:
+def get_variant_counts(data: AnalyticData, highlight: str) -> str:
     '''
-    Given an analytic dataframe, return the counts of variants therein as a formatted string for display on the plot
-    If a highlight pd.Series is also passed, remove those variants from the data before counting
+    Given analytic data, return the counts of variants therein as a formatted string for display on the plot
+    If a highlight mask name is also passed, remove those variants from the data before counting
     '''
     # Use case for removing the highlighted variants is the filtered models
-    filtered = data[~data[highlight]]
-    return f"n={len(data)} ({len(data[data['rsid_x']!=data['rsid_y']])} proxies) subset={len(filtered)} ({round((len(filtered)/len(data))*100, 0)}%)"
+    nfiltered = int((~data[highlight]).sum())
+    return f"n={len(data)} ({int(data['proxy'].sum())} proxies) subset={nfiltered} ({round((nfiltered/len(data))*100, 0)}%)"
+
+def get_presso_test(data) -> str:
+    test = data.attrs['presso']
+    pval = f"p<{1/test['nsim']:.1e}" if test['pval'] == 0 else f"p={test['pval']:.1e}"
+    return f"MR-PRESSO global RSS={test['rss']:.1f} {pval}"
 
 def get_qstats(data, reglines: list):
+    if 'ivw_presso_filtered' in reglines:
+        return get_presso_test(data)
     if 'ivw' in reglines:
-        q, pval, i2 = het.calc_summary_heterogeneity_statistics(data['cochranq_ivw'])
+        q, pval, i2 = het.get_summary_heterogeneity_statistics(data, 'cochranq_ivw')
     elif 'ivw_radial_filtered' in reglines:
-        q, pval, i2 = het.calc_summary_heterogeneity_statistics(data['cochranq_ivw_radial_filtered'])
+        q, pval, i2 = het.get_summary_heterogeneity_statistics(data, 'cochranq_ivw_radial_filtered')
     elif 'radial' in reglines:
-        q, pval, i2 = het.calc_summary_heterogeneity_statistics(data['cochranq_radial'])
+        q, pval, i2 = het.get_summary_heterogeneity_statistics(data, 'cochranq_radial')
     cochran = f"Cochran's Q p={pval:.1e}, (I\u00B2={round(i2,1)})"
     if 'egger_radial' in reglines:
-        q, pval, i2 = het.calc_summary_heterogeneity_statistics(data['ruckerq_radial'])
+        q, pval, i2 = het.get_summary_heterogeneity_statistics(data, 'ruckerq_radial')
         rucker = f"Rucker's Q p={pval:.1e}, (I\u00B2={round(i2,1)})"
         return f"{cochran}\n{rucker}"
     else:
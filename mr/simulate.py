@@ -0,0 +1,69 @@
+'''
+Synthetic analytic dataframes with the columns run_analyses expects, for benchmarking and checking models
+'''
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+# Instruments are simulated directly at the summary-statistic level:
+#   - per-variant SEs follow se = 1/sqrt(2*maf*(1-maf)*n) for maf ~ U(0.05, 0.5)
+#   - true variant-exposure effects are drawn so that |z_x| ~ U(zmin, zmax), i.e. every instrument is genome-wide significant
+#   - variant-outcome effects are causal*gx plus a pleiotropic effect ~ N(pleiotropy_mean, pleiotropy_sd) scaled by se_y
+#   - a fraction outlier_rate of variants get an extra pleiotropic shift of outlier_shift SEs, to be picked up by radial/Steiger
+#   - a fraction proxy_rate of variants are matched to the outcome through a proxy rsid
+# Ratios and their first-order SEs are then derived exactly as in the extracted data
+
+def simulate_analytic_dataframe(nvar=100,
+                                causal=0.2,
+                                pleiotropy_mean=0.0,
+                                pleiotropy_sd=0.0,
+                                outlier_rate=0.0,
+                                outlier_shift=10.0,
+                                proxy_rate=0.1,
+                                n_x=100000,
+                                n_y=100000,
+                                zmin=5.5,
+                                zmax=15.0,
+                                seed=None,
+                                xname='Exposure: simulated',
+                                yname='Outcome: simulated') -> pd.DataFrame:
+    '''
+    Return one synthetic analytic dataframe; seed may be an int or a np.random.Generator
+    '''
+    rng = np.random.default_rng(seed)
+    maf = rng.uniform(0.05, 0.5, nvar)
+    se_x = 1/np.sqrt(2*maf*(1-maf)*n_x)
+    se_y = 1/np.sqrt(2*maf*(1-maf)*n_y)
+    gx = rng.choice([-1, 1], nvar) * rng.uniform(zmin, zmax, nvar) * se_x
+    pleiotropy = rng.normal(pleiotropy_mean, pleiotropy_sd, nvar) * se_y
+    pleiotropy += np.where(rng.random(nvar) < outlier_rate, outlier_shift, 0) * se_y * rng.choice([-1, 1], nvar)
+    beta_x = gx + rng.normal(0, se_x)
+    beta_y = causal*gx + pleiotropy + rng.normal(0, se_y)
+    rsid = np.array([f'rs{i}' for i in range(1, nvar+1)], dtype=object)
+    data = pd.DataFrame({
+        'rsid_x': rsid,
+        'rsid_y': np.where(rng.random(nvar) < proxy_rate, rsid + 'p', rsid),
+        'beta_x': beta_x,
+        'se_x': se_x,
+        'pval_x': 2*norm.sf(np.abs(beta_x/se_x)),
+        'n_x': float(n_x),
+        'beta_y': beta_y,
+        'se_y': se_y,
+        'pval_y': 2*norm.sf(np.abs(beta_y/se_y)),
+        'n_y': float(n_y)
+    })
+    data['ratio'] = data['beta_y']/data['beta_x']
+    data['ratio_se'] = data['se_y']/data['beta_x'].abs()
+    data['ratio_z'] = data['ratio']/data['ratio_se']
+    data['ratio_inv_se'] = data['ratio_se']**-1
+    data.attrs = {'xname': xname, 'yname': yname}
+    return data
+
+def simulate_pairs(npairs: int, nvar=100, seed=None, **kwargs) -> list:
+    '''
+    List of (xy, yx) analytic dataframes for npairs synthetic pairs; the reverse direction has no causal effect
+    '''
+    rng = np.random.default_rng(seed)
+    return [(simulate_analytic_dataframe(nvar, seed=rng, xname=f'Exposure: {i}', yname=f'Outcome: {i}', **kwargs),
+             simulate_analytic_dataframe(nvar, seed=rng, xname=f'Outcome: {i}', yname=f'Exposure: {i}', **{**kwargs, 'causal': 0.0}))
+            for i in range(npairs)]
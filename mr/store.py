@@ -0,0 +1,144 @@
+'''
+Append-only HDF5 store of model summaries and per-variant flags, so that batch runs are durable and resumable
+'''
+import os
+import numpy as np
+import pandas as pd
+from .models import het
+from .data import AnalyticData
+
+# The store holds three PyTables 'table' format nodes, all appended to and never rewritten:
+#   - summary: one row per (exposure, outcome, direction, model) with slope, intercept and summary heterogeneity where defined
+#   - variants: one row per (exposure, outcome, direction, variant) with the fitted flags and per-variant Q statistics
+#     Flags are stored as floats (1.0/0.0), NaN where the statistic was not computed for that run (e.g. presso_fail without
+#     MR-PRESSO), so an uncomputed flag is never read back as a variant that passed
+#   - pairs: one row per completed pair, written last, so a pair interrupted mid-write is not treated as done on resume
+# exposure and outcome are the HDF paths given to the run (direction 'yx' rows keep the pair's orientation)
+# They are indexed data columns, so one pair can be selected with a where clause without reading the whole table
+# If a run is killed between tables, the rerun appends that pair again; reads keep only the last copy of each row
+
+KEY_COLUMNS = ['exposure', 'outcome', 'direction']
+SUMMARY_COLUMNS = [*KEY_COLUMNS, 'model', 'exposure_name', 'outcome_name', 'nvar', 'beta', 'se', 'pval',
+                   'intercept', 'intercept_se', 'intercept_pval', 'q', 'q_pval', 'i2']
+VARIANT_FLOAT_COLUMNS = ['beta_x', 'se_x', 'beta_y', 'se_y', 'ratio', 'ratio_se',
+                         'cochranq_ivw', 'cochranq_radial', 'ruckerq_radial', 'cochranq_ivw_radial_filtered']
+VARIANT_FLAG_COLUMNS = ['proxy', 'steiger_fail', 'radial_fail', 'presso_fail']
+# Per-variant Q statistics that summarise heterogeneity around each model's fit
+QSTATS = {
+    'ivw': 'cochranq_ivw',
+    'radial': 'cochranq_radial',
+    'egger_radial': 'ruckerq_radial',
+    'ivw_radial_filtered': 'cochranq_ivw_radial_filtered'
+}
+MIN_ITEMSIZE = {'exposure': 512, 'outcome': 512, 'direction': 4, 'model': 32,
+                'exposure_name': 256, 'outcome_name': 256, 'rsid_x': 64, 'rsid_y': 64}
+
+def summarise_model(res) -> dict:
+    '''
+    Slope and (if fitted) intercept from a regression result, or the estimate from the weighted median dict
+    '''
+    if isinstance(res, dict):
+        return {'nvar': res['nvar'], 'beta': res['beta'], 'se': res['se'], 'pval': res['pval']}
+    term = res.params.index[-1]
+    summary = {'nvar': res.nobs, 'beta': res.params[term], 'se': res.bse[term], 'pval': res.pvalues[term]}
+    if 'Intercept' in res.params:
+        summary.update({'intercept': res.params['Intercept'], 'intercept_se': res.bse['Intercept'],
+                        'intercept_pval': res.pvalues['Intercept']})
+    return summary
+
+def summarise_direction(exposure: str, outcome: str, direction: str, data: AnalyticData, res: dict) -> pd.DataFrame:
+    rows = []
+    for model in res:
+        row = {'exposure': exposure, 'outcome': outcome, 'direction': direction, 'model': model,
+               'exposure_name': str(data.attrs.get('xname', '')), 'outcome_name': str(data.attrs.get('yname', '')),
+               **summarise_model(res[model])}
+        if QSTATS.get(model) in data:
+            row['q'], row['q_pval'], row['i2'] = het.get_summary_heterogeneity_statistics(data, QSTATS[model])
+        rows.append(row)
+    summary = pd.DataFrame(rows).reindex(columns=SUMMARY_COLUMNS)
+    summary['nvar'] = summary['nvar'].astype(float)
+    return summary
+
+def tabulate_variants(exposure: str, outcome: str, direction: str, data: AnalyticData) -> pd.DataFrame:
+    variants = pd.DataFrame({'exposure': exposure, 'outcome': outcome, 'direction': direction,
+                             'rsid_x': data['rsid_x'].astype(str), 'rsid_y': data['rsid_y'].astype(str)})
+    for col in VARIANT_FLOAT_COLUMNS:
+        variants[col] = data[col] if col in data else np.nan
+    for col in VARIANT_FLAG_COLUMNS:
+        variants[col] = data[col].astype(float) if col in data else np.nan
+    return variants
+
+def append_pair(path: str, exposure: str, outcome: str, xy: tuple, yx: tuple):
+    '''
+    Append both directions of one pair; xy and yx are the (data, results) tuples returned by run_analyses
+    '''
+    summary = pd.concat([summarise_direction(exposure, outcome, 'xy', *xy), summarise_direction(exposure, outcome, 'yx', *yx)], ignore_index=True)
+    variants = pd.concat([tabulate_variants(exposure, outcome, 'xy', xy[0]), tabulate_variants(exposure, outcome, 'yx', yx[0])], ignore_index=True)
+    pairs = pd.DataFrame({'exposure': [exposure], 'outcome': [outcome]})
+    append_tables(path, {'summary': summary, 'variants': variants, 'pairs': pairs})
+
+def append_tables(path: str, tables: dict):
+    '''
+    Append each table to its node, in the order given (so pairs should come last)
+    '''
+    with pd.HDFStore(path, mode='a') as store:
+        for key, table in tables.items():
+            store.append(key, table, format='table', data_columns=[c for c in ['exposure', 'outcome', 'direction', 'model'] if c in table],
+                         min_itemsize={c: n for c, n in MIN_ITEMSIZE.items() if c in table})
+
+def completed_pairs(path: str) -> set:
+    '''
+    Set of (exposure, outcome) pairs already fully written, read from the small pairs table only
+    '''
+    if not os.path.exists(path):
+        return set()
+    with pd.HDFStore(path, mode='r') as store:
+        if 'pairs' not in store:
+            return set()
+        pairs = store.select('pairs')
+    return set(zip(pairs['exposure'], pairs['outcome']))
+
+def drop_repeats(rows: pd.DataFrame, table: str) -> pd.DataFrame:
+    '''
+    Keep the last copy of rows written more than once for the same pair after an interrupted run
+    '''
+    keys = {'summary': [*KEY_COLUMNS, 'model'], 'variants': [*KEY_COLUMNS, 'rsid_x', 'rsid_y'], 'pairs': ['exposure', 'outcome']}[table]
+    return rows.drop_duplicates(subset=keys, keep='last')
+
+def select_pair(path: str, exposure: str, outcome: str, table='summary') -> pd.DataFrame:
+    '''
+    Read the rows for one pair from the summary or variants table
+    '''
+    # The where clause resolves exposure and outcome from this function's local scope, so paths need no quoting
+    with pd.HDFStore(path, mode='r') as store:
+        return drop_repeats(store.select(table, where='(exposure == exposure) & (outcome == outcome)'), table)
+
+def select_all(path: str, table='summary') -> pd.DataFrame:
+    with pd.HDFStore(path, mode='r') as store:
+        return drop_repeats(store.select(table), table)
+
+def merge_stores(paths: list, outpath: str) -> set:
+    '''
+    Combine completed pairs from several stores (e.g. one per shard) into a new store at outpath, replacing any existing file
+    Rows for pairs missing from a store's pairs table (interrupted mid-write) are left out
+    Return the set of merged pairs
+    '''
+    # Written to a temporary file and moved into place, so rerunning a merge never leaves a partial or doubled store
+    tmppath = f'{outpath}.tmp'
+    if os.path.exists(tmppath):
+        os.remove(tmppath)
+    merged = set()
+    for path in paths:
+        done = completed_pairs(path) - merged
+        if not done:
+            continue
+        tables = {}
+        for table in ['summary', 'variants', 'pairs']:
+            rows = select_all(path, table)
+            keep = [pair in done for pair in zip(rows['exposure'], rows['outcome'])]
+            tables[table] = rows[keep]
+        append_tables(tmppath, tables)
+        merged |= done
+    if merged:
+        os.replace(tmppath, outpath)
+    return merged
@@ -0,0 +1,144 @@
+'''
+Per-stage timing and allocation records for the MR pipeline, delivered to pluggable sinks, plus opt-in profiling of single pairs
+'''
+import os
+import json
+import time
+import logging
+import cProfile
+import pstats
+import tracemalloc
+import contextlib
+import contextvars
+
+# Pipeline code wraps each stage in `with timing.stage('name', nvar=...)`
+# With no sinks registered, stage() returns a shared no-op context manager, so instrumentation costs one list check per stage
+# Sinks are callables taking one record dict, e.g. a list's append or a LogSink; records hold:
+#   stage, seconds, nvar, pid, any labels set by enclosing timing.labels() blocks (e.g. xpath/ypath of the pair),
+#   and alloc_bytes/peak_bytes (net and peak traced allocation within the stage) while tracemalloc is tracing
+# Labels and the peak-memory stack are context variables, so threads (e.g. extraction prefetch) keep separate records
+# Peak memory of an outer stage includes its nested stages, even though each nested stage resets the tracemalloc peak
+
+SINKS = []
+LABELS = contextvars.ContextVar('labels', default={})
+PEAKS = contextvars.ContextVar('peaks', default=())
+
+def add_sink(sink):
+    SINKS.append(sink)
+
+def remove_sink(sink):
+    SINKS.remove(sink)
+
+def emit(record: dict):
+    '''
+    Send a record to every sink; also used to forward records collected in worker processes
+    '''
+    for sink in SINKS:
+        sink(record)
+
+class LogSink:
+    '''
+    Sink writing each record as a JSON log message
+    '''
+    def __init__(self, logger: logging.Logger = None, level=logging.INFO):
+        self.logger = logging.getLogger('mr.timing') if logger is None else logger
+        self.level = level
+
+    def __call__(self, record: dict):
+        self.logger.log(self.level, json.dumps(record, default=str))
+
+class Stage:
+    def __init__(self, name: str, nvar: int = None):
+        self.record = {'stage': name, 'nvar': nvar}
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            self.start_bytes = current
+            # PEAKS holds the running peak of each open stage; fold in the peak so far before resetting it for this stage
+            outer = PEAKS.get()
+            if outer:
+                outer = (*outer[:-1], max(outer[-1], peak))
+            PEAKS.set((*outer, current))
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record['seconds'] = time.perf_counter() - self.start
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            *outer, own = PEAKS.get()
+            own = max(own, peak)
+            PEAKS.set((*outer[:-1], max(outer[-1], own)) if outer else ())
+            self.record.update({'alloc_bytes': current - self.start_bytes, 'peak_bytes': own - self.start_bytes})
+        emit({**self.record, 'pid': os.getpid(), **LABELS.get()})
+        return False
+
+NULL_STAGE = contextlib.nullcontext()
+
+def stage(name: str, nvar: int = None):
+    '''
+    Context manager timing one pipeline stage, or a no-op when no sinks are registered
+    '''
+    if not SINKS:
+        return NULL_STAGE
+    return Stage(name, nvar)
+
+@contextlib.contextmanager
+def labels(**kwargs):
+    '''
+    Attach labels (e.g. xpath, ypath) to every record emitted inside the block
+    '''
+    token = LABELS.set({**LABELS.get(), **kwargs})
+    try:
+        yield
+    finally:
+        LABELS.reset(token)
+
+@contextlib.contextmanager
+def collect(exclusive=False):
+    '''
+    Temporarily add a list sink, yielding the list of records emitted inside the block
+    With exclusive, other sinks are suspended inside the block, e.g. in forked workers that inherit the parent's sinks
+    but return their records for the parent to re-emit
+    '''
+    records = []
+    suspended = SINKS[:] if exclusive else []
+    if exclusive:
+        SINKS.clear()
+    add_sink(records.append)
+    try:
+        yield records
+    finally:
+        remove_sink(records.append)
+        SINKS.extend(suspended)
+
+@contextlib.contextmanager
+def profile(outprefix: str = None, memory=True, nframes=1):
+    '''
+    Opt-in cProfile (and tracemalloc) capture around one pair
+    Yields a dict that holds 'stats' (pstats.Stats) and 'snapshot' (tracemalloc.Snapshot) once the block exits
+    If outprefix is given, the profile is dumped to {outprefix}.prof and the top allocations to {outprefix}.alloc.txt
+    '''
+    captured = {}
+    profiler = cProfile.Profile()
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(nframes)
+    profiler.enable()
+    try:
+        yield captured
+    finally:
+        profiler.disable()
+        captured['stats'] = pstats.Stats(profiler)
+        if memory:
+            captured['snapshot'] = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        if outprefix is not None:
+            profiler.dump_stats(f'{outprefix}.prof')
+            if memory:
+                with open(f'{outprefix}.alloc.txt', 'w') as f:
+                    f.writelines(f'{line}\n' for line in captured['snapshot'].statistics('lineno')[:50])
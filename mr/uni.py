@@ -1,56 +1,259 @@
 '''
 Top-level module to run univariaable MR models
 '''
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
 import pandas as pd
 import numpy as np
-import statsmodels.formula.api as smf
-from scipy.stats import chi2
-from .models import med, steig, het
-from .plot import panel
+from .models import med, steig, het, wls, presso
+from . import cache, timing
+from .data import AnalyticData
+from .plot import render
 from sumstats.extract import instrument
 
-def run_main(data: pd.DataFrame) -> dict:
-    return {
-        'ivw': smf.wls('beta_y ~ beta_x - 1', data, weights=data['se_y']**-2).fit(),
-        'egger': smf.wls('beta_y ~ beta_x', data, weights=data['se_y']**-2).fit(),
-        'wm': med.run_wm(data)
-    }
-
-def run_steiger(data: pd.DataFrame): 
-    data['steiger_fail'] = steig.flag_failures(data)
-    steiger_filt = data[~(data['steiger_fail'])]
-    res = {
-        'ivw_steig_filtered': smf.wls('beta_y ~ beta_x - 1', steiger_filt, weights=steiger_filt['se_y']**-2).fit()
-    }
+# Regressions use the closed-form fits in models.wls, which match statsmodels WLS/OLS but skip formula parsing
+# The (x, y, weights) choices below correspond to the formulas previously passed to smf.wls and smf.ols
+# Data is an AnalyticData (or a masked view of one); fittedvalues are indexed by row position in the unfiltered data
+
+def fit_ivw(data: AnalyticData) -> wls.WLSResult:
+    # beta_y ~ beta_x - 1, weighted by se_y**-2
+    return wls.fit(data['beta_x'], data['beta_y'], data['se_y']**-2, xname='beta_x', index=data.index)
+
+def fit_egger(data: AnalyticData) -> wls.WLSResult:
+    # beta_y ~ beta_x, weighted by se_y**-2
+    return wls.fit(data['beta_x'], data['beta_y'], data['se_y']**-2, intercept=True, xname='beta_x', index=data.index)
+
+def fit_ivw_radial(data: AnalyticData) -> wls.WLSResult:
+    # ratio_z ~ ratio_inv_se - 1, unweighted
+    return wls.fit(data['ratio_inv_se'], data['ratio_z'], xname='ratio_inv_se', index=data.index)
+
+def fit_egger_radial(data: AnalyticData) -> wls.WLSResult:
+    # ratio_z ~ ratio_inv_se, unweighted
+    return wls.fit(data['ratio_inv_se'], data['ratio_z'], intercept=True, xname='ratio_inv_se', index=data.index)
+
+# ----->>>>> Lazy, dependency-aware evaluation for run_analyses
+
+# Every model (a fitted result) and per-variant statistic (a column or mask written to the data) is a node with dependencies
+# Requested statistics, and the statistics that requested models depend on, are resolved when run_analyses is called,
+# pulling in only the models they need (cheap closed-form fits), so the returned data has every column the models use
+# Requested models are resolved on first access to the returned LazyResults mapping, so e.g. the weighted median bootstrap
+# only runs if something reads res['wm']; asking for ivw_radial_filtered resolves radial_fail and hence the radial fits first
+# Pickling a LazyResults (e.g. returning it from a batch worker) evaluates all requested models and sends a plain dict
+
+def node_steiger_fail(data, res, options):
+    data['steiger_fail'] = steig.flag_failures(data, options['steiger_fast'], options['steiger_source'])
+
+def node_cochranq_radial(data, res, options):
+    data['cochranq_radial'] = het.calc_cochranq_per_variant(data, res['radial'].params['ratio_inv_se'], return_pvals=False)
+
+def node_ruckerq_radial(data, res, options):
+    data['ruckerq_radial'] = het.calc_ruckerq_per_variant(data, res['egger_radial'], return_pvals=False)
+
+def node_radial_fail(data, res, options):
+    if options['iterative_radial']:
+        # Kept in attrs, as for MR-PRESSO, so unconverged runs (whose last outliers are left unflagged) can be told apart
+        iterative = het.run_iterative_radial(data)
+        data['radial_fail'] = iterative['removed']
+        data.attrs['radial'] = {'niter': iterative['niter'], 'converged': iterative['converged']}
+    else:
+        data.attrs.pop('radial', None)
+        # Per-variant p-values of both Q columns from one chi2.sf pass, as two segments of a ragged array
+        nvar = len(data)
+        pval = het.summarise_ragged(np.concatenate([data['cochranq_radial'], data['ruckerq_radial']]), [0, nvar, 2*nvar])['pval']
+        data['radial_fail'] = (pval[:nvar] < 0.05) | (pval[nvar:] < 0.05)
+
+def node_cochranq_ivw(data, res, options):
+    data['cochranq_ivw'] = het.calc_cochranq_per_variant(data, res['ivw'].params['beta_x'], return_pvals=False)
+
+def node_cochranq_ivw_radial_filtered(data, res, options):
+    # Stored at full length, with NaN for the radial failures that the filtered model excludes
+    data['cochranq_ivw_radial_filtered'] = np.where(data['radial_fail'], np.nan, 
+                                                    het.calc_cochranq_per_variant(data, res['ivw_radial_filtered'].params['beta_x'], return_pvals=False))
+
+def node_presso_fail(data, res, options):
+    # The global test is kept in attrs for display and storage alongside the per-variant outlier flags
+    settings = {'seed': options['seed'], **options['presso']}
+    test = presso.run_presso(data, **settings)
+    data['presso_fail'] = test['outliers']
+    data.attrs['presso'] = {'rss': float(test['rss']), 'pval': float(test['pval']), 'nsim': test['nsim']}
+
+# Per-variant Q columns with a summary Q, p-value and I2 (for the models in store.QSTATS)
+QSTAT_COLUMNS = ['cochranq_ivw', 'cochranq_radial', 'ruckerq_radial', 'cochranq_ivw_radial_filtered']
+
+def summarise_heterogeneity(datas: list):
+    '''
+    Summarise every per-variant Q column present in each of many analytic datasets in one batched pass (het.summarise_ragged)
+    Results are cached in data.attrs['heterogeneity'] as {column: (q, pval, i2)}, where plotting and the store read them
+    Masked views are skipped, since they share attrs with their full data
+    '''
+    segments = [(data, column) for data in datas if not data.is_view for column in QSTAT_COLUMNS if column in data]
+    if not segments:
+        return
+    offsets = np.cumsum([0] + [len(data) for data, column in segments])
+    summary = het.summarise_ragged(np.concatenate([data[column] for data, column in segments]), offsets, return_pvals=False)
+    for k, (data, column) in enumerate(segments):
+        data.attrs.setdefault('heterogeneity', {})[column] = (float(summary['q'][k]), float(summary['q_pval'][k]), float(summary['i2'][k]))
+
+def node_heterogeneity(data, res, options):
+    summarise_heterogeneity([data])
+
+# name: (dependencies, function(data, resolved results, options) returning the fitted model)
+MODELS = {
+    'ivw': ([], lambda data, res, options: fit_ivw(data)),
+    'egger': ([], lambda data, res, options: fit_egger(data)),
+    'wm': ([], lambda data, res, options: med.run_wm(data, options['nboot'], options['seed'])),
+    'ivw_steig_filtered': (['steiger_fail'], lambda data, res, options: fit_ivw(data[~data['steiger_fail']])),
+    'radial': ([], lambda data, res, options: fit_ivw_radial(data)),
+    'egger_radial': ([], lambda data, res, options: fit_egger_radial(data)),
+    'ivw_radial_filtered': (['radial_fail'], lambda data, res, options: fit_ivw(data[~data['radial_fail']])),
+    'egger_radial_filtered': (['radial_fail'], lambda data, res, options: fit_egger(data[~data['radial_fail']])),
+    'ivw_presso_filtered': (['presso_fail'], lambda data, res, options: fit_ivw(data[~data['presso_fail']]))
+}
+# name: (dependencies, function(data, resolved results, options) writing the statistic to data)
+# Rucker Q could also be calculated for main and radial filtered models, but not bothering
+STATISTICS = {
+    'steiger_fail': ([], node_steiger_fail),
+    'cochranq_radial': (['radial'], node_cochranq_radial),
+    'ruckerq_radial': (['egger_radial'], node_ruckerq_radial),
+    'radial_fail': (['cochranq_radial', 'ruckerq_radial'], node_radial_fail),
+    'cochranq_ivw': (['ivw'], node_cochranq_ivw),
+    'cochranq_ivw_radial_filtered': (['radial_fail', 'ivw_radial_filtered'], node_cochranq_ivw_radial_filtered),
+    'presso_fail': ([], node_presso_fail),
+    'heterogeneity': (QSTAT_COLUMNS, node_heterogeneity)
+}
+# MR-PRESSO simulations cost far more than the other nodes, so they are left out of the defaults unless requested
+PRESSO = ['presso_fail', 'ivw_presso_filtered']
+
+class LazyResults(Mapping):
+    '''
+    Read-only mapping of model name to fitted result, evaluating each model (and its dependencies) on first access
+    '''
+    def __init__(self, data: AnalyticData, models: list, options: dict):
+        self.data = data
+        self.models = list(models)
+        self.options = options
+        self.fitted = {}
+        self.resolved = set()
+
+    def resolve(self, *names):
+        '''
+        Evaluate the named models or statistics, and anything they depend on, if not already done
+        '''
+        for name in names:
+            if name in self.resolved:
+                continue
+            deps, func = MODELS[name] if name in MODELS else STATISTICS[name]
+            self.resolve(*deps)
+            with timing.stage(name, len(self.data)):
+                value = func(self.data, self.fitted, self.options)
+            if name in MODELS:
+                self.fitted[name] = value
+            self.resolved.add(name)
+
+    def __getitem__(self, model: str):
+        if model not in self.models:
+            raise KeyError(model)
+        self.resolve(model)
+        return self.fitted[model]
+
+    def __iter__(self):
+        return iter(self.models)
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+def run_analyses(data, 
+                 models: list = None, 
+                 statistics: list = None, 
+                 nboot=1000, 
+                 seed=None, 
+                 iterative_radial=False, 
+                 steiger_fast=False,
+                 steiger_source='betase',
+                 presso=False):
+    '''
+    For a given preprocessed dataframe (or AnalyticData), add Steiger and Radial flags and run all models
+    models and statistics restrict the output to a subset of MODELS and STATISTICS; by default everything is available
+    If only models are given, only the statistics they depend on are computed (before returning, so they are in the data)
+    nboot and seed are passed to the weighted median bootstrap; iterative_radial and steiger_fast are as for run_radial and run_steiger
+    steiger_source selects the inputs of the fast Steiger F ('betase' or 'pval', see steig.get_fstats) and only applies with steiger_fast
+    presso adds MR-PRESSO outlier flags and the filtered IVW to the defaults; pass a dict (e.g. {'nsim': 5000, 'chunksize': 100})
+    to override presso.run_presso settings, whose seed defaults to seed
+    Return the modified data as AnalyticData and a LazyResults mapping of model results (dict(res) evaluates them all)
+    '''
+    unknown = set(models or []) - set(MODELS) | set(statistics or []) - set(STATISTICS)
+    if unknown:
+        raise ValueError(f'Unknown models or statistics: {sorted(unknown)}')
+    if models is None and statistics is None:
+        statistics = [name for name in STATISTICS if presso or name not in PRESSO]
+    if models is None:
+        models = [name for name in MODELS if presso or name not in PRESSO]
+    with timing.stage('run_analyses', len(data)):
+        if isinstance(data, pd.DataFrame):
+            data = AnalyticData.from_frame(data)
+        # Summaries cached by an earlier run on this data would no longer match its columns
+        data.attrs.pop('heterogeneity', None)
+        options = {'nboot': nboot, 'seed': seed, 'iterative_radial': iterative_radial, 'steiger_fast': steiger_fast, 'steiger_source': steiger_source,
+                   'presso': presso if isinstance(presso, dict) else {}}
+        res = LazyResults(data, models, options)
+        res.resolve(*(statistics or []), *(dep for model in models for dep in MODELS[model][0]))
     return data, res
 
-def run_radial(data: pd.DataFrame):
-    res = {
-        'radial': smf.ols('ratio_z ~ ratio_inv_se - 1', data).fit(),
-        'egger_radial': smf.ols('ratio_z ~ ratio_inv_se', data).fit()
-    }
-    data['cochranq_radial'], cochradp = het.calc_cochranq_per_variant(data, res['radial'].params['ratio_inv_se'])
-    data['ruckerq_radial'], ruckradp = het.calc_ruckerq_per_variant(data, res['egger_radial'])
-    data['radial_fail'] = np.where(((cochradp < 0.05) | (ruckradp < 0.05)), True, False)
-    radial_filt = data[~data['radial_fail']]
-    filt = {
-        'ivw_radial_filtered': smf.wls('beta_y ~ beta_x - 1', radial_filt, weights=radial_filt['se_y']**-2).fit(),
-        'egger_radial_filtered': smf.wls('beta_y ~ beta_x', radial_filt, weights=radial_filt['se_y']**-2).fit()
-    }
-    return data, {**res, **filt}
-
-def run_analyses(data):
+# Stage groups of run_analyses, evaluated eagerly through the same nodes (e.g. to benchmark stages separately)
+
+def run_main(data: AnalyticData, nboot=1000, seed=None) -> dict:
+    data, res = run_analyses(data, models=['ivw', 'egger', 'wm'], nboot=nboot, seed=seed)
+    return dict(res)
+
+def run_steiger(data: AnalyticData, fast=False, source='betase'): 
+    data, res = run_analyses(data, models=['ivw_steig_filtered'], steiger_fast=fast, steiger_source=source)
+    return data, dict(res)
+
+def run_radial(data: AnalyticData, iterative=False):
+    '''
+    Fit radial IVW and Egger, flag radial outliers and refit the main models without them
+    With iterative, outliers are removed repeatedly until none remain (see het.run_iterative_radial)
+    '''
+    data, res = run_analyses(data, models=['radial', 'egger_radial', 'ivw_radial_filtered', 'egger_radial_filtered'], iterative_radial=iterative)
+    return data, dict(res)
+
+def run_direction(xpath: str,
+                  ypath: str,
+                  signalkey='main',
+                  get_proxies=True,
+                  omit=None,
+                  rsids=None,
+                  cachedir=None,
+                  profile=None,
+                  **kwargs):
     '''
-    For a given preprocessed dataframe, add Steiger and Radial flags and run all models
-    Return the modified data and a dict of results
+    Extract the analytic dataframe for a single x -> y direction and run all models on it
+    If cachedir is given, extraction goes through the on-disk cache in that directory
+    If profile is given, cProfile and tracemalloc output for this direction are written with it as the path prefix
+    Remaining kwargs are passed to run_analyses
+    Return the modified data and a mapping of results, as for run_analyses
+    While profiling or timing, every model is evaluated here, so that its cost is captured and labelled with this direction
     '''
-    main = run_main(data)
-    data, steiger = run_steiger(data)
-    data, radial = run_radial(data)
-    data['cochranq_ivw'] = het.calc_cochranq_per_variant(data, main['ivw'].params['beta_x'], return_pvals=False)
-    data['cochranq_ivw_radial_filtered'] = het.calc_cochranq_per_variant(data[~data['radial_fail']], radial['ivw_radial_filtered'].params['beta_x'], return_pvals=False)
-    # Rucker Q could also be calculated here for main and radial filtered models, but not bothering
-    return data, {**main, **steiger, **radial}
+    with timing.labels(xpath=xpath, ypath=ypath), (timing.profile(profile) if profile is not None else contextlib.nullcontext()):
+        data = extract_direction(xpath, ypath, signalkey, get_proxies, omit, rsids, cachedir)
+        data, res = run_analyses(data, **kwargs)
+        if profile is not None or timing.SINKS:
+            res = dict(res)
+        return data, res
+
+def extract_direction(xpath: str, ypath: str, signalkey='main', get_proxies=True, omit=None, rsids=None, cachedir=None) -> pd.DataFrame:
+    '''
+    Extract the analytic dataframe for a single x -> y direction, through the on-disk cache if cachedir is given
+    '''
+    with timing.labels(xpath=xpath, ypath=ypath), timing.stage('extract'):
+        if cachedir is None:
+            return instrument.get_analytic_dataframe(xpath, ypath, signalkey, get_proxies, omit, rsids)
+        return cache.get_analytic_dataframe(xpath, ypath, signalkey, get_proxies, omit, rsids, cachedir=cachedir)
 
 def from_hdfpaths(xpath: str, 
                   ypath: str, 
@@ -60,17 +263,33 @@ def from_hdfpaths(xpath: str,
                   omitx = None,
                   rsidsx = None,
                   omity = None,
-                  rsidsy = None):
+                  rsidsy = None,
+                  cachedir = None,
+                  plot = True,
+                  profile = None):
+    '''
+    Run both directions of MR for one pair of HDF paths and return (proc_xy, res_xy, proc_yx, res_yx)
+    plot can be True (render the panel now, to the working directory), False (skip) or a plot.render.Renderer
+    profile is an optional path prefix for per-direction profiles (suffixed .xy and .yx)
+    '''
     # When there are multiple signals or instrument tables we can also add in an option for that, to pass to sumstats.extract.instrument
-    data_xy = instrument.get_analytic_dataframe(xpath, ypath, xsignalkey, get_proxies, omitx, rsidsx)
-    data_yx = instrument.get_analytic_dataframe(ypath, xpath, ysignalkey, get_proxies, omity, rsidsy)
-    proc_xy, res_xy = run_analyses(data_xy)
-    proc_yx, res_yx = run_analyses(data_yx)
-    panel.mr_panel(proc_xy, proc_yx, res_xy, res_yx)
-    
-    
-
-    
-    
-        
-    
\ No newline at end of file
+    if profile is not None:
+        # Profiles cover extraction too, so both directions run in this thread
+        proc_xy, res_xy = run_direction(xpath, ypath, xsignalkey, get_proxies, omitx, rsidsx, cachedir, profile=f'{profile}.xy')
+        proc_yx, res_yx = run_direction(ypath, xpath, ysignalkey, get_proxies, omity, rsidsy, cachedir, profile=f'{profile}.yx')
+    else:
+        # The reverse direction is extracted in a background thread while the forward direction is extracted and analysed
+        # (HDF reads release the GIL); see batch.run_pipelined for the same overlap across many pairs
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future_yx = executor.submit(contextvars.copy_context().run, extract_direction, ypath, xpath, ysignalkey, get_proxies, omity, rsidsy, cachedir)
+            proc_xy, res_xy = run_direction(xpath, ypath, xsignalkey, get_proxies, omitx, rsidsx, cachedir)
+            data_yx = future_yx.result()
+        with timing.labels(xpath=ypath, ypath=xpath):
+            proc_yx, res_yx = run_analyses(data_yx)
+            if timing.SINKS:
+                res_yx = dict(res_yx)
+    if plot:
+        renderer = render.Renderer() if plot is True else plot
+        with timing.labels(xpath=xpath, ypath=ypath):
+            renderer.submit(proc_xy, proc_yx, res_xy, res_yx)
+    return proc_xy, res_xy, proc_yx, res_yx
@@ -6,5 +6,6 @@ setup(
     description='Tools to run python-implemented MR models using standardised HDF input',
     url='https://github.com/danetics/epid-mr',
     author='Daniel Wright',
-    install_requires=['pandas', 'numpy', 'h5py','statsmodels','scipy>=1.10.1', 'tables','matplotlib'],
+    install_requires=['pandas', 'numpy', 'h5py','statsmodels','scipy>=1.10.1', 'tables','matplotlib','pyarrow'],
+    entry_points={'console_scripts': ['epid-mr=mr.cli:main']},
 )
\ No newline at end of file
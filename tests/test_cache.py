@@ -0,0 +1,50 @@
+'''
+Checks of the extraction cache: canonical keys for equivalent filters, and Parquet entries that round-trip data and attrs
+'''
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from mr import simulate
+
+cache = pytest.importorskip('mr.cache', reason='sumstats is needed to import the extraction cache')
+
+@pytest.fixture
+def paths(tmp_path) -> tuple:
+    xpath, ypath = tmp_path / 'x.h5', tmp_path / 'y.h5'
+    xpath.write_bytes(b'x')
+    ypath.write_bytes(b'y')
+    return str(xpath), str(ypath)
+
+def test_key_is_canonical(paths):
+    key = cache.get_key(*paths, 'main', True, {'a': ['rs2', 'rs1'], 'b': {'rs3'}}, None)
+    # Ordering of mappings and iterables, container types and numpy scalars do not change the key
+    assert cache.get_key(*paths, 'main', True, {'b': ('rs3',), 'a': {'rs1', 'rs2'}}, None) == key
+    assert cache.get_key(*paths, 'main', 1, {'a': np.array(['rs1', 'rs2']), 'b': ['rs3']}, None) == key
+    for changed in [cache.get_key(*paths, 'main', True, {'a': ['rs1'], 'b': ['rs3']}, None),
+                    cache.get_key(*paths, 'main', True, None, {'a': ['rs2', 'rs1'], 'b': {'rs3'}}),
+                    cache.get_key(*paths, 'other', True, {'a': ['rs2', 'rs1'], 'b': {'rs3'}}, None),
+                    cache.get_key(*paths[::-1], 'main', True, {'a': ['rs2', 'rs1'], 'b': {'rs3'}}, None)]:
+        assert changed != key
+
+def test_key_changes_when_input_is_rewritten(paths):
+    key = cache.get_key(*paths, 'main', True, None, None)
+    with open(paths[0], 'ab') as f:
+        f.write(b'more')
+    assert cache.get_key(*paths, 'main', True, None, None) != key
+
+def test_entry_round_trips_data_and_attrs(paths, tmp_path, monkeypatch):
+    data = simulate.simulate_analytic_dataframe(30, seed=4)
+    data.attrs = {'xname': 'Exposure', 'yname': 'Outcome'}
+    calls = []
+    def extract(*args):
+        calls.append(args)
+        return data.copy()
+    monkeypatch.setattr(cache.instrument, 'get_analytic_dataframe', extract)
+    cachedir = str(tmp_path / 'cache')
+    first = cache.get_analytic_dataframe(*paths, cachedir=cachedir)
+    second = cache.get_analytic_dataframe(*paths, cachedir=cachedir)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(second, data)
+    assert second.attrs == data.attrs == first.attrs
+    assert [name for name in os.listdir(cachedir) if not name.endswith('.parquet')] == []
@@ -0,0 +1,44 @@
+'''
+Checks that the batched MV-IVW and MV-Egger fits in multi reproduce per-outcome statsmodels WLS
+'''
+import numpy as np
+import pytest
+import statsmodels.api as sm
+from mr import multi
+
+@pytest.fixture(scope='module')
+def inputs() -> dict:
+    rng = np.random.default_rng(3)
+    n, k, m = 60, 3, 4
+    bx = rng.normal(0, 0.1, (n, k))
+    se_y = rng.uniform(0.01, 0.05, (n, m))
+    by = bx @ rng.normal(0, 0.5, (k, m)) + rng.normal(0, 1, (n, m))*se_y
+    return {'bx': bx, 'by': by, 'se_y': se_y}
+
+def expected_fit(X, y, w):
+    keep = ~np.isnan(y)
+    return sm.WLS(y[keep], X[keep], weights=w[keep]).fit()
+
+@pytest.mark.parametrize('shared, missing', [(True, False), (False, False), (True, True)])
+def test_run_mvmr_matches_statsmodels(inputs, shared, missing):
+    bx, by = inputs['bx'], inputs['by'].copy()
+    # With shared weights and no missing values every outcome is solved against one factorised design;
+    # an outcome missing some instruments moves the fit onto the per-outcome path
+    if missing:
+        by[:7, 1] = np.nan
+    weights = inputs['se_y'][:, 0]**-2 if shared else inputs['se_y']**-2
+    res = multi.run_mvmr(bx, by, weights=weights)
+    sign = np.where(bx[:, 0] < 0, -1.0, 1.0)
+    for i in range(by.shape[1]):
+        w = weights if shared else weights[:, i]
+        ivw = expected_fit(bx, by[:, i], w)
+        egger = expected_fit(sm.add_constant(bx*sign[:, None]), by[:, i]*sign, w)
+        for key, attr in [('beta', 'params'), ('se', 'bse'), ('pval', 'pvalues')]:
+            np.testing.assert_allclose(res['ivw'][key][i], getattr(ivw, attr), rtol=1e-8)
+            np.testing.assert_allclose(res['egger'][key][i], getattr(egger, attr)[1:], rtol=1e-8)
+            np.testing.assert_allclose(res['egger'][f'intercept_{key}' if key != 'beta' else 'intercept'][i], getattr(egger, attr)[0], rtol=1e-8)
+        # The weighted residual sum of squares is Cochran's Q
+        assert np.isclose(res['ivw']['q'][i], ivw.ssr, rtol=1e-8)
+        assert res['ivw']['q_df'][i] == ivw.df_resid
+        assert np.isclose(res['egger']['q'][i], egger.ssr, rtol=1e-8)
+        assert res['egger']['q_df'][i] == egger.df_resid
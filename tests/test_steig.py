@@ -0,0 +1,33 @@
+'''
+Checks of the fast Steiger F path against the exact F-distribution quantiles, within the accuracy bound documented in models.steig
+'''
+import numpy as np
+import pytest
+from scipy.stats import t
+from mr import simulate
+from mr.models import steig
+
+@pytest.mark.parametrize('n', [30, 1000, 100000])
+def test_f_fast_from_pval_within_bound(n):
+    pval = np.logspace(-300, np.log10(0.9), 2000)
+    exact = t.isf(pval/2, n-1)**2
+    fast = steig.calc_f_fast(n, pval=pval)
+    # Bound checked against z**2/(n-1), approximately the variance explained
+    z = steig.calc_z_from_logp(np.log(pval))
+    for ratio, tol in [(0.1, 1e-6), (0.2, 1e-5)]:
+        within = z**2/(n-1) <= ratio
+        assert within.any()
+        np.testing.assert_allclose(fast[within], exact[within], rtol=tol)
+
+def test_f_fast_uses_wald_for_underflowed_pval():
+    beta, se, n = np.array([0.5, 0.1]), np.array([0.01, 0.05]), np.array([10000, 10000])
+    fstat = steig.calc_f_fast(n, beta, se, pval=np.array([0.0, 0.05]))
+    assert fstat[0] == (0.5/0.01)**2
+    assert np.isclose(fstat[1], t.isf(0.025, n[1]-1)**2, rtol=1e-6)
+
+@pytest.mark.parametrize('source', ['betase', 'pval'])
+def test_flag_failures_stacked_matches_per_frame(source):
+    frames = [simulate.simulate_analytic_dataframe(nvar, seed=seed, outlier_rate=0.2) for seed, nvar in enumerate([50, 1, 120])]
+    stacked = steig.flag_failures_stacked(frames, source=source)
+    for frame, flags in zip(frames, stacked):
+        np.testing.assert_array_equal(flags, steig.flag_failures(frame, fast=True, source=source))
@@ -0,0 +1,55 @@
+'''
+Checks that the append-only store resumes cleanly: only fully written pairs count as complete, and repeated rows are read once
+'''
+import numpy as np
+import pytest
+from mr import simulate, store
+from mr.data import AnalyticData
+from mr.models import wls
+
+pytest.importorskip('tables', reason='PyTables is needed for HDF5 table stores')
+
+def get_direction(seed: int) -> tuple:
+    # A stand-in for run_analyses output: IVW and Egger fits plus one computed flag
+    data = AnalyticData.from_frame(simulate.simulate_analytic_dataframe(20, seed=seed))
+    data['steiger_fail'] = np.arange(len(data)) % 5 == 0
+    weights = data['se_y']**-2
+    res = {'ivw': wls.fit(data['beta_x'], data['beta_y'], weights, xname='beta_x'),
+           'egger': wls.fit(data['beta_x'], data['beta_y'], weights, intercept=True, xname='beta_x')}
+    return data, res
+
+def test_resume_skips_only_complete_pairs(tmp_path):
+    path = str(tmp_path / 'results.h5')
+    assert store.completed_pairs(path) == set()
+    store.append_pair(path, 'x.h5', 'y.h5', get_direction(1), get_direction(2))
+    # A pair interrupted after its summary and variant rows, before its pairs row
+    xy, yx = get_direction(3), get_direction(4)
+    store.append_tables(path, {'summary': store.summarise_direction('x.h5', 'z.h5', 'xy', *xy),
+                               'variants': store.tabulate_variants('x.h5', 'z.h5', 'xy', xy[0])})
+    assert store.completed_pairs(path) == {('x.h5', 'y.h5')}
+    # Rerunning the interrupted pair appends it again in full
+    store.append_pair(path, 'x.h5', 'z.h5', xy, yx)
+    assert store.completed_pairs(path) == {('x.h5', 'y.h5'), ('x.h5', 'z.h5')}
+
+    summary = store.select_pair(path, 'x.h5', 'z.h5')
+    assert len(summary) == 4
+    assert set(zip(summary['direction'], summary['model'])) == {(d, m) for d in ['xy', 'yx'] for m in ['ivw', 'egger']}
+    expected = xy[1]['ivw']
+    row = summary[(summary['direction'] == 'xy') & (summary['model'] == 'ivw')].iloc[0]
+    assert np.isclose(row['beta'], expected.params['beta_x']) and np.isclose(row['se'], expected.bse['beta_x'])
+
+    variants = store.select_pair(path, 'x.h5', 'z.h5', 'variants')
+    assert len(variants) == len(xy[0]) + len(yx[0])
+    np.testing.assert_array_equal(variants.loc[variants['direction'] == 'xy', 'steiger_fail'], xy[0]['steiger_fail'])
+    # Flags that were never computed are missing rather than False
+    assert variants['radial_fail'].isna().all() and variants['presso_fail'].isna().all()
+
+def test_merge_stores_keeps_complete_pairs(tmp_path):
+    paths = [str(tmp_path / f'shard-{i}.h5') for i in range(2)]
+    store.append_pair(paths[0], 'x.h5', 'y.h5', get_direction(1), get_direction(2))
+    store.append_pair(paths[1], 'y.h5', 'z.h5', get_direction(3), get_direction(4))
+    xy = get_direction(5)
+    store.append_tables(paths[1], {'summary': store.summarise_direction('x.h5', 'z.h5', 'xy', *xy)})
+    outpath = str(tmp_path / 'merged.h5')
+    assert store.merge_stores(paths, outpath) == {('x.h5', 'y.h5'), ('y.h5', 'z.h5')}
+    assert set(zip(*store.select_all(outpath)[['exposure', 'outcome']].values.T)) == {('x.h5', 'y.h5'), ('y.h5', 'z.h5')}
@@ -0,0 +1,31 @@
+'''
+Regression checks that the closed-form fits in models.wls reproduce the statsmodels results they replaced
+'''
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.formula.api as smf
+from mr import simulate
+from mr.models import wls
+
+# (x, y, weighted) as used by uni.fit_ivw/fit_egger (weighted by se_y**-2) and fit_ivw_radial/fit_egger_radial (unweighted)
+DESIGNS = [('beta_x', 'beta_y', True), ('ratio_inv_se', 'ratio_z', False)]
+
+@pytest.fixture(scope='module')
+def data() -> pd.DataFrame:
+    return simulate.simulate_analytic_dataframe(200, seed=1, outlier_rate=0.1)
+
+@pytest.mark.parametrize('intercept', [False, True])
+@pytest.mark.parametrize('xcol, ycol, weighted', DESIGNS)
+def test_fit_matches_statsmodels(data, xcol, ycol, weighted, intercept):
+    formula = f"{ycol} ~ {xcol}" + ('' if intercept else ' - 1')
+    if weighted:
+        expected = smf.wls(formula, data=data, weights=data['se_y']**-2).fit()
+    else:
+        expected = smf.ols(formula, data=data).fit()
+    res = wls.fit(data[xcol], data[ycol], data['se_y']**-2 if weighted else None, intercept=intercept)
+    for attr in ['params', 'bse', 'pvalues', 'tvalues', 'fittedvalues', 'resid']:
+        pd.testing.assert_series_equal(getattr(res, attr), getattr(expected, attr), check_names=False, rtol=1e-10, atol=0)
+    assert res.df_resid == expected.df_resid
+    assert res.nobs == expected.nobs
+    assert np.isclose(res.scale, expected.scale, rtol=1e-10)